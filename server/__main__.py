@@ -1,4 +1,7 @@
 import logging
+from pathlib import Path
+
+import numpy as np
 
 from aiohttp import web
 from aiohttp.web_request import Request
@@ -6,10 +9,19 @@ from aiohttp.web_response import Response
 from aiohttp_apispec import docs, request_schema, response_schema
 from marshmallow import Schema, fields, validate
 
-from server.analysis.analyzer import ImageAnalyzer
-from server.analysis.types import Point
+from server.analysis.compressor.encoding import EncodingProfile, CHROMA_SUBSAMPLING_FACTORS
+from server.analysis.roi_maker import RoiRow, atlas_layout
+from server.analysis.types import Point, Size, Rectangle
+from server.camera import CameraRegistry, CameraWorker, load_camera_configs
+from server.clips import FrameHistory, HistoryHandler, ClipHandler
 from server.logging import load_logger_config
+from server.metrics import PrometheusText
 from server.server import RestHandler, Server
+from server.push import PushChannel, PushHandler
+from server.snapshot import SnapshotHandler
+from server.statistics.aggregates import OccupancyStatistics
+from server.statistics.api import FreeProbabilityHandler, AverageOccupancyHandler, FreeStreakHandler
+from server.statistics.store import OccupancyStore
 
 
 logger = logging.getLogger(__name__)
@@ -39,9 +51,79 @@ class PoISchema(Schema):
     points = fields.Nested(PointSchema(many=True), validate=validate.Length(equal=4))
 
 
+class RowSizeSchema(Schema):
+    width = fields.Int(required=True, validate=validate.Range(min=1))
+    height = fields.Int(required=True, validate=validate.Range(min=1))
+
+
+class RoiRowSchema(Schema):
+    name = fields.Str(required=True)
+    points = fields.Nested(PointSchema(many=True), required=True, validate=validate.Length(equal=4))
+    size = fields.Nested(RowSizeSchema, required=True, description="size of the row in the ROI atlas")
+    top_left = fields.Nested(PointSchema, dump_only=True, description="position of the row in the ROI atlas")
+
+
+class RoiRowsSchema(Schema):
+    rows = fields.Nested(RoiRowSchema(many=True), required=True, validate=validate.Length(min=1))
+    atlas_size = fields.Nested(SizeSchema, dump_only=True)
+
+
+class SpotsSchema(Schema):
+    spots = fields.Nested(RectangleSchema(many=True), required=True)
+
+
+class LaneSchema(Schema):
+    points = fields.Nested(PointSchema(many=True), validate=validate.Length(min=3))
+
+
+class LanesSchema(Schema):
+    lanes = fields.Nested(LaneSchema(many=True), required=True)
+
+
+class LaneProjectionRequestSchema(Schema):
+    lane = fields.Int(required=True, description="lane the points are projected to")
+    target = fields.Int(description="lane the projected points are mapped to by their parameter t")
+    points = fields.Nested(PointSchema(many=True), required=True)
+
+
+class LanePointSchema(Schema):
+    x = fields.Float()
+    y = fields.Float()
+    t = fields.Float(description="position along the lane from 0 to 1")
+    distance = fields.Float(description="distance of the requested point from the lane")
+
+
+class LaneProjectionSchema(Schema):
+    points = fields.Nested(LanePointSchema(many=True))
+
+
+class SpotOccupancySchema(Schema):
+    id = fields.Int()
+    occupied = fields.Bool()
+    confidence = fields.Float()
+
+
+class OccupancySchema(Schema):
+    timestamp = fields.Float()
+    spots = fields.Nested(SpotOccupancySchema(many=True))
+
+
+class EncodingProfileSchema(Schema):
+    quality = fields.Int(validate=validate.Range(min=0, max=100))
+    chroma_subsampling = fields.Str(validate=validate.OneOf(list(CHROMA_SUBSAMPLING_FACTORS)))
+    optimize = fields.Bool()
+    progressive = fields.Bool()
+    scale = fields.Float(validate=validate.Range(min=0.05, max=1.0))
+
+
+class EncodingSchema(Schema):
+    profiles = fields.Dict(keys=fields.Str(), values=fields.Nested(EncodingProfileSchema))
+    streams = fields.Dict(keys=fields.Str(), values=fields.Str(), description="profile name of each stream")
+
+
 class PoiHandler(RestHandler):
-    def __init__(self, analyzer: ImageAnalyzer):
-        self.analyzer = analyzer
+    def __init__(self, camera: CameraWorker):
+        self.camera = camera
 
     @docs(
         tags=["analysis"],
@@ -50,7 +132,7 @@ class PoiHandler(RestHandler):
     )
     @response_schema(PoISchema())
     async def get(self, request: Request) -> Response:
-        return web.json_response(PoISchema().dump({"points": self.analyzer.poi}))
+        return web.json_response(PoISchema().dump({"points": self.camera.poi}))
 
     @docs(
         tags=["analysis"],
@@ -64,29 +146,355 @@ class PoiHandler(RestHandler):
             Point(**point)
             for point in points
         ]
-        self.analyzer.poi = poi
+        self.camera.poi = poi
         return web.json_response({"message": "POI set successfully"})
 
 
+class RowsHandler(RestHandler):
+    def __init__(self, camera: CameraWorker):
+        self.camera = camera
+
+    @docs(
+        tags=["analysis"],
+        summary="Get ROI rows",
+        description="Named polygons warped together into one ROI atlas, rows are stacked from top to bottom",
+    )
+    @response_schema(RoiRowsSchema())
+    async def get(self, request: Request) -> Response:
+        rows = self.camera.rows
+        atlas_size, placement = atlas_layout(rows)
+        return web.json_response(RoiRowsSchema().dump({
+            "rows": [
+                {"name": row.name, "points": row.polygon, "size": row.size, "top_left": placement[row.name].top_left}
+                for row in rows
+            ],
+            "atlas_size": atlas_size,
+        }))
+
+    @docs(
+        tags=["analysis"],
+        summary="Set ROI rows",
+        description="Named polygons warped together into one ROI atlas, spots are in atlas coordinates",
+    )
+    @request_schema(RoiRowsSchema())
+    async def post(self, request: Request) -> Response:
+        rows = [
+            RoiRow(row["name"], [Point(**point) for point in row["points"]], Size(**row["size"]))
+            for row in request["data"]["rows"]
+        ]
+        try:
+            self.camera.rows = rows
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+        return web.json_response({"message": "Rows set successfully"})
+
+
+class SpotsHandler(RestHandler):
+    def __init__(self, camera: CameraWorker):
+        self.camera = camera
+
+    @docs(
+        tags=["analysis"],
+        summary="Get parking spots",
+        description="Parking spot rectangles in ROI atlas coordinates, spot id is its index",
+    )
+    @response_schema(SpotsSchema())
+    async def get(self, request: Request) -> Response:
+        return web.json_response(SpotsSchema().dump({"spots": self.camera.spots}))
+
+    @docs(
+        tags=["analysis"],
+        summary="Set parking spots",
+        description="Parking spot rectangles in ROI atlas coordinates, spot id is its index",
+    )
+    @request_schema(SpotsSchema())
+    async def post(self, request: Request) -> Response:
+        spots = [
+            Rectangle(Point(**spot["top_left"]), Size(**spot["size"]))
+            for spot in request["data"]["spots"]
+        ]
+        self.camera.spots = spots
+        return web.json_response({"message": "Spots set successfully"})
+
+
+class LanesHandler(RestHandler):
+    def __init__(self, camera: CameraWorker):
+        self.camera = camera
+
+    @docs(
+        tags=["analysis"],
+        summary="Get lanes",
+        description="Points of parking lanes in camera image coordinates, lanes are interpolated by B-splines",
+    )
+    @response_schema(LanesSchema())
+    async def get(self, request: Request) -> Response:
+        lanes = [{"points": points} for points in self.camera.lanes.lanes]
+        return web.json_response(LanesSchema().dump({"lanes": lanes}))
+
+    @docs(
+        tags=["analysis"],
+        summary="Set lanes",
+        description="Points of parking lanes in camera image coordinates, lanes are interpolated by B-splines",
+    )
+    @request_schema(LanesSchema())
+    async def post(self, request: Request) -> Response:
+        self.camera.lanes.lanes = [
+            [Point(**point) for point in lane["points"]]
+            for lane in request["data"]["lanes"]
+        ]
+        return web.json_response({"message": "Lanes set successfully"})
+
+
+class LaneProjectionHandler(RestHandler):
+    def __init__(self, camera: CameraWorker):
+        self.camera = camera
+
+    @docs(
+        tags=["analysis"],
+        summary="Project points to lane",
+        description="Closest lane points of all given points, optionally mapped to another lane by their position",
+    )
+    @request_schema(LaneProjectionRequestSchema())
+    @response_schema(LaneProjectionSchema())
+    async def post(self, request: Request) -> Response:
+        data = request["data"]
+        points = np.array([(point["x"], point["y"]) for point in data["points"]], dtype=np.float64)
+        try:
+            projected, t, distances = self.camera.lanes.closest_point(data["lane"], points)
+            if "target" in data:
+                projected = self.camera.lanes.lane(data["target"]).evaluate(t)
+        except (IndexError, ValueError) as e:
+            raise web.HTTPBadRequest(text=str(e))
+
+        lane_points = [
+            {"x": x, "y": y, "t": point_t, "distance": distance}
+            for (x, y), point_t, distance in zip(projected.tolist(), t.tolist(), distances.tolist())
+        ]
+        return web.json_response(LaneProjectionSchema().dump({"points": lane_points}))
+
+
+class OccupancyHandler(RestHandler):
+    def __init__(self, camera: CameraWorker):
+        self.camera = camera
+
+    @docs(
+        tags=["analysis"],
+        summary="Get current occupancy",
+        description="Occupancy of every parking spot from the last analyzed frame",
+    )
+    @response_schema(OccupancySchema())
+    async def get(self, request: Request) -> Response:
+        occupancy = self.camera.last_occupancy
+        if occupancy is None:
+            return web.json_response(OccupancySchema().dump({"timestamp": 0.0, "spots": []}))
+
+        spots = [
+            {"id": spot_id, "occupied": occupied, "confidence": confidence}
+            for spot_id, (occupied, confidence) in enumerate(zip(
+                occupancy.occupied.tolist(), occupancy.confidence.tolist()
+            ))
+        ]
+        return web.json_response(OccupancySchema().dump({"timestamp": occupancy.timestamp, "spots": spots}))
+
+
+class EncodingHandler(RestHandler):
+    def __init__(self, camera: CameraWorker):
+        self.camera = camera
+
+    @docs(
+        tags=["analysis"],
+        summary="Get encoding profiles",
+        description="Named JPEG encoding profiles and the profile used by each output stream",
+    )
+    @response_schema(EncodingSchema())
+    async def get(self, request: Request) -> Response:
+        return web.json_response(EncodingSchema().dump({
+            "profiles": self.camera.encoding_profiles,
+            "streams": self.camera.stream_profiles,
+        }))
+
+    @docs(
+        tags=["analysis"],
+        summary="Set encoding profiles",
+        description="Adds or replaces named JPEG encoding profiles and assigns them to output streams",
+    )
+    @request_schema(EncodingSchema())
+    async def post(self, request: Request) -> Response:
+        data = request["data"]
+        profiles = {
+            name: EncodingProfile(**profile)
+            for name, profile in data.get("profiles", {}).items()
+        }
+        try:
+            self.camera.set_encoding(profiles, data.get("streams"))
+        except KeyError as e:
+            raise web.HTTPBadRequest(text=str(e))
+        return web.json_response({"message": "Encoding set successfully"})
+
+
+class CameraSchema(Schema):
+    name = fields.Str()
+    source_type = fields.Str()
+    fps = fields.Float()
+    streams = fields.List(fields.Str())
+    stage_throughput = fields.Dict(keys=fields.Str(), values=fields.Float())
+
+
+class CamerasSchema(Schema):
+    cameras = fields.Nested(CameraSchema(many=True))
+
+
+class CamerasHandler(RestHandler):
+    def __init__(self, cameras: CameraRegistry):
+        self.cameras = cameras
+
+    @docs(
+        tags=["cameras"],
+        summary="Get cameras",
+        description="Configured cameras, the first one is also served by the routes without camera name",
+    )
+    @response_schema(CamerasSchema())
+    async def get(self, request: Request) -> Response:
+        cameras = [
+            {
+                "name": camera.name,
+                "source_type": camera.config.source_type,
+                "fps": camera.config.fps,
+                "streams": camera.output_images_names,
+                "stage_throughput": camera.status.get("stage_throughput", {}),
+            }
+            for camera in self.cameras
+        ]
+        return web.json_response(CamerasSchema().dump({"cameras": cameras}))
+
+
+class MetricsHandler(RestHandler):
+    def __init__(self, cameras: CameraRegistry):
+        self.cameras = cameras
+
+    @docs(
+        tags=["metrics"],
+        summary="Get metrics",
+        description="Stage latencies, frame counters and MJPEG delivery of all cameras in Prometheus text format",
+    )
+    async def get(self, request: Request) -> Response:
+        cameras = [(camera.name, camera.status) for camera in self.cameras]
+        streams = [
+            ({"camera": camera.name, "stream": name, "size": size}, variant)
+            for camera in self.cameras
+            for name, stream in camera.streams.items()
+            for size, variant in (("full", stream), ("low", stream.low_resolution))
+        ]
+
+        text = PrometheusText()
+        text.histogram("parking_stage_latency_seconds", "Time spent in a step of the analysis pipeline", [
+            ({"camera": name, "stage": stage}, histogram)
+            for name, status in cameras
+            for stage, histogram in status.get("latency", {}).items()
+        ])
+        text.counter("parking_stage_frames_total", "Frames processed by a pipeline stage", [
+            ({"camera": name, "stage": stage}, count)
+            for name, status in cameras
+            for stage, count in status.get("stage_frame_counts", {}).items()
+        ])
+        text.counter("parking_dropped_frames_total", "Frames replaced before a slower stage took them", [
+            ({"camera": name, "stage": stage}, count)
+            for name, status in cameras
+            for stage, count in status.get("dropped_frames", {}).items()
+        ])
+        text.counter("parking_skipped_frames_total", "Frames not analyzed", [
+            sample
+            for name, status in cameras
+            for sample in (
+                ({"camera": name, "reason": "capture_failure"}, status.get("capture_failures", 0)),
+                ({"camera": name, "reason": "unchanged"}, status.get("skipped_frames", 0)),
+            )
+        ])
+        text.counter("parking_encoded_frames_total", "Frames encoded to JPEG", [
+            ({"camera": name, "stream": stream}, statistics.encoded)
+            for name, status in cameras
+            for stream, statistics in status.get("compressor_statistics", {}).items()
+        ])
+        text.counter("parking_encoder_dropped_frames_total", "Frames replaced while waiting for an encoder", [
+            ({"camera": name, "stream": stream}, statistics.dropped)
+            for name, status in cameras
+            for stream, statistics in status.get("compressor_statistics", {}).items()
+        ])
+        text.gauge("parking_mjpeg_clients", "Connected MJPEG clients", [
+            (labels, stream.client_count) for labels, stream in streams
+        ])
+        text.counter("parking_mjpeg_sent_frames_total", "Frames sent to MJPEG clients", [
+            (labels, stream.frames_sent) for labels, stream in streams
+        ])
+        text.counter("parking_mjpeg_sent_bytes_total", "Bytes sent to MJPEG clients", [
+            (labels, stream.bytes_sent) for labels, stream in streams
+        ])
+        return web.Response(body=text.render().encode(), headers={"Content-Type": PrometheusText.CONTENT_TYPE})
+
+
+def add_camera_routes(
+        server: Server,
+        prefix: str,
+        camera: CameraWorker,
+        statistics: OccupancyStatistics,
+        push_channel: PushChannel,
+        history: FrameHistory,
+) -> None:
+    server.add_handler(f"{prefix}/poi", PoiHandler(camera))
+    server.add_handler(f"{prefix}/rows", RowsHandler(camera))
+    server.add_handler(f"{prefix}/spots", SpotsHandler(camera))
+    server.add_handler(f"{prefix}/lanes", LanesHandler(camera))
+    server.add_handler(f"{prefix}/lanes/projection", LaneProjectionHandler(camera))
+    server.add_handler(f"{prefix}/occupancy", OccupancyHandler(camera))
+    server.add_handler(f"{prefix}/encoding", EncodingHandler(camera))
+    server.add_handler(f"{prefix}/snapshot/{{name}}", SnapshotHandler(camera.streams))
+    server.add_handler(f"{prefix}/push", PushHandler(push_channel))
+    server.add_handler(f"{prefix}/history", HistoryHandler(history))
+    server.add_handler(f"{prefix}/clips/{{name}}", ClipHandler(history))
+    server.add_handler(f"{prefix}/statistics/free-probability", FreeProbabilityHandler(statistics))
+    server.add_handler(f"{prefix}/statistics/average-occupancy", AverageOccupancyHandler(statistics))
+    server.add_handler(f"{prefix}/statistics/free-streak", FreeStreakHandler(statistics))
+
+
 if __name__ == '__main__':
     load_logger_config("log_config.json")
     server = Server()
 
-    analyzer = ImageAnalyzer()
+    cameras = CameraRegistry()
+    occupancy_stores = []
+    server.add_handler("/api/v1/cameras", CamerasHandler(cameras))
+    server.add_handler("/api/v1/metrics", MetricsHandler(cameras))
 
-    poi_handler = PoiHandler(analyzer)
-    server.add_handler("/api/v1/poi", poi_handler)
+    for config in load_camera_configs("cameras.json"):
+        image_streams = {
+            name: server.add_mjpeg_stream(f"/mjpeg/{config.name}/{name}")
+            for name in config.output_images_names
+        }
+        camera = cameras.add(config, image_streams)
 
-    image_streams = {
-        name: server.add_mjpeg_stream(f"/mjpeg/{name}")
-        for name in analyzer.output_images_names
-    }
+        occupancy_store = OccupancyStore(Path("data") / "occupancy" / config.name)
+        camera.add_occupancy_listener(occupancy_store.append)
+        occupancy_stores.append(occupancy_store)
+        occupancy_statistics = OccupancyStatistics(occupancy_store)
+        camera.add_occupancy_listener(occupancy_statistics.append)
+        push_channel = PushChannel(image_streams)
+        camera.add_occupancy_listener(push_channel.publish_occupancy)
+        history = FrameHistory(config.output_images_names, config.history_bytes)
+        camera.add_frame_listener(history.append)
 
-    for name, stream in image_streams.items():
-        analyzer.assign_stream(name, stream)
+        add_camera_routes(
+            server, f"/api/v1/cameras/{config.name}", camera, occupancy_statistics, push_channel, history
+        )
+        if camera is cameras.default:
+            # routes without camera name are kept for the first camera
+            add_camera_routes(server, "/api/v1", camera, occupancy_statistics, push_channel, history)
+            for name, stream in image_streams.items():
+                server.add_mjpeg_stream(f"/mjpeg/{name}", stream=stream)
 
-    analyzer.start()
+    cameras.start()
 
     server.run()
 
-    analyzer.stop()
+    cameras.stop()
+    for occupancy_store in occupancy_stores:
+        occupancy_store.close()
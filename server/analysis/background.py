@@ -0,0 +1,96 @@
+import logging
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundModel:
+    # Running per-pixel mean and variance of the illumination normalized ROI luminance. Every frame is divided by
+    # its local mean brightness first, so clouds, dusk and headlights change the model much less than objects do.
+    # Pixels far from the mean in units of their standard deviation are foreground; they are learned slower, so
+    # a car parked for a long time fades into the background only gradually. All buffers are allocated once per
+    # ROI size and every step writes into them.
+    _mean: Optional[np.ndarray]
+
+    def __init__(
+            self,
+            learning_rate=0.02,
+            foreground_learning_rate=0.002,
+            threshold=3.0,
+            min_variance=0.0025,
+            initial_variance=0.01,
+            illumination_kernel=63,
+    ):
+        self.learning_rate = learning_rate
+        self.foreground_learning_rate = foreground_learning_rate
+        self.threshold = threshold
+        self.min_variance = min_variance
+        self.initial_variance = initial_variance
+        self._illumination_kernel = (illumination_kernel, illumination_kernel)
+        self._shape = None
+        self._mean = None
+        self.frames = 0
+
+    def reset(self) -> None:
+        # the next frame becomes the background, used when the ROI changes
+        self.frames = 0
+
+    def apply(self, roi: np.ndarray, foreground: np.ndarray = None) -> np.ndarray:
+        # returns foreground mask of 0 and 255 with shape of the ROI, written into foreground when given
+        shape = roi.shape[:2]
+        if shape != self._shape:
+            self._allocate(shape)
+        if foreground is None or foreground.shape != shape:
+            foreground = self._foreground
+
+        normalized = self._normalize(roi)
+        if self.frames == 0:
+            np.copyto(self._mean, normalized)
+            self._variance.fill(self.initial_variance)
+            foreground.fill(0)
+            self.frames = 1
+            return foreground
+
+        np.subtract(normalized, self._mean, out=self._difference)
+        np.multiply(self._difference, self._difference, out=self._squared)
+        np.maximum(self._variance, self.min_variance, out=self._scratch)
+        self._scratch *= self.threshold * self.threshold
+        cv2.compare(self._squared, self._scratch, cv2.CMP_GT, dst=foreground)
+
+        # per pixel rate, mask is 0 or 255
+        np.multiply(foreground, (self.foreground_learning_rate - self.learning_rate) / 255, out=self._rate)
+        self._rate += self.learning_rate
+
+        # exponentially weighted mean and variance
+        np.multiply(self._rate, self._difference, out=self._scratch)
+        self._mean += self._scratch
+        np.multiply(self._rate, self._squared, out=self._scratch)
+        self._scratch += self._variance
+        np.subtract(1.0, self._rate, out=self._variance)
+        self._variance *= self._scratch
+        self.frames += 1
+        return foreground
+
+    def _normalize(self, roi: np.ndarray) -> np.ndarray:
+        # luminance divided by its blurred copy, 1.0 is the local average brightness
+        if roi.ndim == 3:
+            cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY, dst=self._gray)
+        else:
+            np.copyto(self._gray, roi)
+        np.copyto(self._luminance, self._gray)
+        cv2.blur(self._luminance, self._illumination_kernel, dst=self._illumination)
+        self._illumination += 1.0
+        np.divide(self._luminance, self._illumination, out=self._normalized)
+        return self._normalized
+
+    def _allocate(self, shape: Tuple[int, int]) -> None:
+        logger.debug(f"Allocating background model of {shape[1]}x{shape[0]}")
+        self._shape = shape
+        self._gray = np.empty(shape, dtype=np.uint8)
+        self._foreground = np.empty(shape, dtype=np.uint8)
+        self._luminance, self._illumination, self._normalized, self._mean, self._variance, self._difference, \
+            self._squared, self._scratch, self._rate = (np.empty(shape, dtype=np.float32) for _ in range(9))
+        self.frames = 0
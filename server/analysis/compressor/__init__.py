@@ -1,36 +1,160 @@
+import logging
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from multiprocessing import Queue, Process
+from threading import Thread, Lock
+from typing import Deque, Dict, Callable, Iterable, List, Set, Tuple
+
 import numpy as np
-from multiprocessing import Queue, Value, Process
 
 from server.analysis.compressor._run import _run
+from server.analysis.compressor.encoding import EncodingProfile
+from server.analysis.frame_ring import SharedFrameRing, FrameHeader
+from server.metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CompressorStatistics:
+    encoded: int = 0
+    dropped: int = 0
+
+
+class CompressorPool:
+    _free_slots: Deque[int]
+    _idle_workers: Deque[int]
+    _pending: "OrderedDict[str, Tuple[FrameHeader, List[int], float, float]]"
+    _in_flight: Set[str]
+    _workers: List[Process]
+    _statistics: Dict[str, CompressorStatistics]
 
+    def __init__(
+            self,
+            names: Iterable[str],
+            max_frame_size: int,
+            on_compressed: Callable[[str, bytes], None],
+            workers=2,
+    ):
+        if workers <= 0:
+            raise ValueError("workers must be greater than 0")
 
-class Compressor:
-    def __init__(self):
-        self._is_running = Value("i", False)
-        self._input_image_queue = Queue()
-        self._output_image_queue = Queue()
-        self._process = None
+        self._names = set(names)
+        self._on_compressed = on_compressed
+        self._task_queues = [Queue() for _ in range(workers)]
+        self._result_queue = Queue()
+
+        # every worker holds at most one frame and every stream keeps at most one pending frame
+        slot_count = workers + len(self._names)
+        self._input_ring = SharedFrameRing(slot_count, max_frame_size)
+        # encoded image can be bigger than the raw one for noisy images with high quality
+        self._output_ring = SharedFrameRing(workers, 2 * max_frame_size)
+
+        self._lock = Lock()
+        self._free_slots = deque(range(slot_count))
+        self._pending = OrderedDict()
+        self._in_flight = set()
+        self._idle_workers = deque(range(workers))
+        self._statistics = {name: CompressorStatistics() for name in self._names}
+        self._latency = {"encode_queue_wait": Histogram(), "encode": Histogram()}
+        self._workers = []
+        self._collector = Thread(target=self._collect, name="compressor-collector", daemon=True)
+
+    @property
+    def statistics(self) -> Dict[str, CompressorStatistics]:
+        with self._lock:
+            return {
+                name: CompressorStatistics(statistics.encoded, statistics.dropped)
+                for name, statistics in self._statistics.items()
+            }
+
+    @property
+    def latency(self) -> Dict[str, Histogram]:
+        with self._lock:
+            return {name: histogram.copy() for name, histogram in self._latency.items()}
 
     def start(self):
-        self._process = Process(
-            target=_run,
-            args=(self._input_image_queue, self._output_image_queue, self._is_running)
+        ring_args = (
+            (self._input_ring.name, self._input_ring.slot_count, self._input_ring.slot_size),
+            (self._output_ring.name, self._output_ring.slot_count, self._output_ring.slot_size),
         )
-        self._is_running.value = True
-        self._process.start()
+        self._workers = [
+            Process(target=_run, args=(task_queue, self._result_queue, worker_id, *ring_args))
+            for worker_id, task_queue in enumerate(self._task_queues)
+        ]
+        for worker in self._workers:
+            worker.start()
+        self._collector.start()
 
     def stop(self):
-        if self._process is None:
-            raise AttributeError("Compressor did not start yet, cannot stop")
+        if not self._workers:
+            raise AttributeError("CompressorPool did not start yet, cannot stop")
 
-        self._is_running.value = False
-        self._input_image_queue.put(np.empty((1, 1, 3), dtype=np.uint8))
-        self._process.join()
+        for task_queue in self._task_queues:
+            task_queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._result_queue.put(None)
+        self._collector.join()
+        self._input_ring.close()
+        self._output_ring.close()
 
-    @property
-    def input_queue(self) -> Queue:
-        return self._input_image_queue
+    def submit(self, name: str, image: np.ndarray, profile: EncodingProfile, scale=1.0) -> None:
+        # never blocks on encoding, a frame which was not picked by any worker yet is replaced by the newer one;
+        # a stream is encoded by one worker at a time, so its frames are published in the order they came
+        if name not in self._names:
+            raise KeyError(f"unknown stream '{name}'")
 
-    @property
-    def output_queue(self) -> Queue:
-        return self._output_image_queue
+        params = profile.imencode_params()
+        scale *= profile.scale
+        submitted_at = time.monotonic()
+        with self._lock:
+            pending = self._pending.get(name)
+            if pending is not None:
+                pending_header = pending[0]
+                self._pending[name] = self._input_ring.write(pending_header.slot, image), params, scale, submitted_at
+                self._statistics[name].dropped += 1
+                return
+
+            header = self._input_ring.write(self._free_slots.popleft(), image)
+            if self._idle_workers and name not in self._in_flight:
+                self._dispatch(name, (header, params, scale, submitted_at))
+            else:
+                self._pending[name] = header, params, scale, submitted_at
+
+    def _dispatch(self, name: str, task: Tuple[FrameHeader, List[int], float, float]) -> None:
+        # output slot of a worker is reused only after its previous result was collected
+        worker_id = self._idle_workers.popleft()
+        self._in_flight.add(name)
+        self._task_queues[worker_id].put((name, *task))
+
+    def _dispatch_pending(self) -> None:
+        # oldest pending frames first, skipping streams whose previous frame is still being encoded
+        for name in list(self._pending):
+            if not self._idle_workers:
+                break
+            if name not in self._in_flight:
+                self._dispatch(name, self._pending.pop(name))
+
+    def _collect(self) -> None:
+        while True:
+            result = self._result_queue.get()
+            if result is None:
+                break
+
+            name, input_slot, worker_id, size, queue_wait, encode_time = result
+            data = self._output_ring.read_bytes(worker_id, size) if size > 0 else None
+
+            with self._lock:
+                self._free_slots.append(input_slot)
+                self._idle_workers.append(worker_id)
+                self._in_flight.discard(name)
+                self._dispatch_pending()
+                if data is not None:
+                    self._statistics[name].encoded += 1
+                self._latency["encode_queue_wait"].observe(queue_wait)
+                self._latency["encode"].observe(encode_time)
+
+            if data is not None:
+                self._on_compressed(name, data)
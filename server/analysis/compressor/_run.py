@@ -1,11 +1,44 @@
-from multiprocessing import Value
+import logging
+import time
 from queue import Queue
+from typing import Tuple
 
 import cv2
 
+from server.analysis.frame_ring import SharedFrameRing
 
-def _run(input_image_queue: Queue, output_compressed_queue: Queue, is_running: Value):
-    while bool(is_running.value):
-        image = input_image_queue.get()
-        _, buff = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 100])
-        output_compressed_queue.put(bytearray(buff))
+logger = logging.getLogger(__name__)
+
+
+def _run(
+        task_queue: Queue,
+        result_queue: Queue,
+        worker_id: int,
+        input_ring_args: Tuple[str, int, int],
+        output_ring_args: Tuple[str, int, int],
+):
+    input_ring = SharedFrameRing.attach(*input_ring_args)
+    output_ring = SharedFrameRing.attach(*output_ring_args)
+    try:
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+
+            name, header, params, scale, submitted_at = task
+            started_at = time.monotonic()  # monotonic clock is shared by processes of one machine
+            image = input_ring.read(header)
+            if scale != 1.0:
+                image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            _, buff = cv2.imencode(".jpg", image, params)
+            del image
+            try:
+                size = output_ring.write_bytes(worker_id, buff)
+            except ValueError as e:
+                logger.error(f"Cannot pass compressed image of stream '{name}': {e}")
+                size = 0
+            queue_wait = started_at - submitted_at
+            result_queue.put((name, header.slot, worker_id, size, queue_wait, time.monotonic() - started_at))
+    finally:
+        input_ring.close()
+        output_ring.close()
@@ -0,0 +1,67 @@
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import cv2
+
+# libjpeg sampling factors, OpenCV exposes them since 4.5.5
+CHROMA_SUBSAMPLING_FACTORS = {
+    "444": 0x111111,
+    "440": 0x121111,
+    "422": 0x211111,
+    "420": 0x221111,
+    "411": 0x411111,
+}
+
+
+@dataclass(frozen=True)
+class EncodingProfile:
+    quality: int = 80
+    chroma_subsampling: str = "420"
+    optimize: bool = False
+    progressive: bool = False
+    scale: float = 1.0
+
+    def imencode_params(self) -> List[int]:
+        params = [
+            cv2.IMWRITE_JPEG_QUALITY, self.quality,
+            cv2.IMWRITE_JPEG_OPTIMIZE, int(self.optimize),
+            cv2.IMWRITE_JPEG_PROGRESSIVE, int(self.progressive),
+        ]
+        sampling_factor_param = getattr(cv2, "IMWRITE_JPEG_SAMPLING_FACTOR", None)
+        if sampling_factor_param is not None:
+            params += [sampling_factor_param, CHROMA_SUBSAMPLING_FACTORS[self.chroma_subsampling]]
+        return params
+
+
+DEFAULT_ENCODING_PROFILES = {
+    "high": EncodingProfile(quality=95, chroma_subsampling="444"),
+    "default": EncodingProfile(),
+    "low": EncodingProfile(quality=60, scale=0.5),
+}
+DEFAULT_STREAM_PROFILES = {
+    "main": "default",
+    "roi": "high",
+}
+DEFAULT_PROFILE_NAME = "default"
+
+
+def merge_encoding(
+        current: Tuple[Dict[str, EncodingProfile], Dict[str, str]],
+        stream_names: Iterable[str],
+        profiles: Optional[Dict[str, EncodingProfile]] = None,
+        stream_profiles: Optional[Dict[str, str]] = None,
+) -> Tuple[Dict[str, EncodingProfile], Dict[str, str]]:
+    current_profiles, current_stream_profiles = current
+    profiles = {**current_profiles, **(profiles or {})}
+    stream_profiles = {**current_stream_profiles, **(stream_profiles or {})}
+
+    stream_names = set(stream_names)
+    for stream_name, profile_name in stream_profiles.items():
+        if stream_name not in stream_names:
+            raise KeyError(f"unknown stream '{stream_name}'")
+        if profile_name not in profiles:
+            raise KeyError(f"unknown encoding profile '{profile_name}'")
+    if DEFAULT_PROFILE_NAME not in profiles:
+        raise KeyError(f"encoding profile '{DEFAULT_PROFILE_NAME}' cannot be removed")
+
+    return profiles, stream_profiles
@@ -0,0 +1,79 @@
+from dataclasses import dataclass
+from multiprocessing.shared_memory import SharedMemory
+from typing import Tuple
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class FrameHeader:
+    slot: int
+    shape: Tuple[int, ...]
+    dtype: str
+
+
+class SharedFrameRing:
+    _memory: SharedMemory
+
+    def __init__(self, slot_count: int, slot_size: int, name: str = None):
+        if slot_count <= 0 or slot_size <= 0:
+            raise ValueError("slot_count and slot_size must be greater than 0")
+
+        self._slot_count = slot_count
+        self._slot_size = slot_size
+        self._is_owner = name is None
+        if self._is_owner:
+            self._memory = SharedMemory(create=True, size=slot_count * slot_size)
+        else:
+            self._memory = SharedMemory(name=name)
+
+    @staticmethod
+    def attach(name: str, slot_count: int, slot_size: int) -> "SharedFrameRing":
+        return SharedFrameRing(slot_count, slot_size, name)
+
+    @property
+    def name(self) -> str:
+        return self._memory.name
+
+    @property
+    def slot_count(self) -> int:
+        return self._slot_count
+
+    @property
+    def slot_size(self) -> int:
+        return self._slot_size
+
+    def slot_buffer(self, slot: int) -> memoryview:
+        if not 0 <= slot < self._slot_count:
+            raise IndexError(f"slot {slot} is out of range of {self._slot_count} slots")
+        offset = slot * self._slot_size
+        return self._memory.buf[offset:offset + self._slot_size]
+
+    def write(self, slot: int, image: np.ndarray) -> FrameHeader:
+        if image.nbytes > self._slot_size:
+            raise ValueError(f"frame of {image.nbytes} B does not fit into slot of {self._slot_size} B")
+        np.copyto(self._view(slot, image.shape, image.dtype), image)
+        return FrameHeader(slot, image.shape, image.dtype.str)
+
+    def read(self, header: FrameHeader) -> np.ndarray:
+        return self._view(header.slot, header.shape, np.dtype(header.dtype))
+
+    def write_bytes(self, slot: int, data) -> int:
+        source = np.frombuffer(data, dtype=np.uint8)
+        size = source.size
+        if size > self._slot_size:
+            raise ValueError(f"data of {size} B does not fit into slot of {self._slot_size} B")
+        np.copyto(np.frombuffer(self.slot_buffer(slot), dtype=np.uint8, count=size), source)
+        return size
+
+    def read_bytes(self, slot: int, size: int) -> bytes:
+        return bytes(self.slot_buffer(slot)[:size])
+
+    def close(self) -> None:
+        self._memory.close()
+        if self._is_owner:
+            self._memory.unlink()
+
+    def _view(self, slot: int, shape: Tuple[int, ...], dtype: np.dtype) -> np.ndarray:
+        size = int(np.prod(shape)) * dtype.itemsize
+        return np.ndarray(shape, dtype=dtype, buffer=self.slot_buffer(slot)[:size])
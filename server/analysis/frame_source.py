@@ -0,0 +1,247 @@
+import glob
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from fractions import Fraction
+from threading import Lock
+from typing import Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from server.analysis.types import Size
+
+logger = logging.getLogger(__name__)
+
+
+class FrameSource(ABC):
+    @property
+    @abstractmethod
+    def fps(self) -> float:
+        pass
+
+    @property
+    def is_exhausted(self) -> bool:
+        # live sources never end
+        return False
+
+    @abstractmethod
+    def read(self) -> Tuple[bool, Optional[np.ndarray]]:
+        pass
+
+    def release(self) -> None:
+        pass
+
+
+class _Throttle:
+    # keeps frames at their native rate, unthrottled sources are read as fast as they can be decoded
+    def __init__(self, fps: float, realtime: bool):
+        self._period = 1 / fps if realtime and fps > 0 else 0.0
+        self._next_frame_time = None
+
+    def wait(self) -> None:
+        if self._period == 0.0:
+            return
+        now = time.monotonic()
+        if self._next_frame_time is None or now - self._next_frame_time > self._period:
+            self._next_frame_time = now  # do not try to catch up after a stall
+        elif self._next_frame_time > now:
+            time.sleep(self._next_frame_time - now)
+        self._next_frame_time += self._period
+
+
+class CaptureFrameSource(FrameSource):
+    def __init__(self, source: str, api_preference: int, fps: float):
+        self._fps = fps
+        self._capture = cv2.VideoCapture(source, api_preference)
+
+    @property
+    def fps(self) -> float:
+        return self._fps
+
+    def read(self) -> Tuple[bool, Optional[np.ndarray]]:
+        return self._capture.read()
+
+    def release(self) -> None:
+        self._capture.release()
+
+
+@dataclass
+class GStreamerPipeline:
+    # Scales and converts frames to BGR inside GStreamer and keeps only the newest decoded frame in appsink, so a slow
+    # consumer drops frames instead of building up latency.
+    rtsp_url: str
+    fps: float = 10
+    output_size: Optional[Size] = None
+    latency_ms: int = 200
+    decoder_threads: int = 0  # 0 lets the decoder choose
+    max_buffers: int = 1
+    transport: str = "udp"
+
+    def build(self) -> str:
+        caps = "video/x-raw,format=BGR"
+        if self.output_size is not None:
+            caps += f",width={self.output_size.width},height={self.output_size.height}"
+        framerate = Fraction(self.fps).limit_denominator(1000)
+        caps += f",framerate={framerate.numerator}/{framerate.denominator}"
+
+        return " ! ".join([
+            f"rtspsrc location=\"{self.rtsp_url}\" latency={self.latency_ms} protocols={self.transport}",
+            "rtph264depay",
+            "h264parse",
+            f"avdec_h264 max-threads={self.decoder_threads}",
+            "videoconvert",
+            "videoscale",
+            "videorate",
+            caps,
+            f"appsink drop=true max-buffers={self.max_buffers} sync=false",
+        ])
+
+
+CAPTURE_BACKENDS = ("gstreamer", "ffmpeg")
+RTSP_TRANSPORTS = ("udp", "tcp")
+
+# OpenCV reads FFMPEG options from the environment when a capture is opened, cameras running as threads of one
+# process open their captures one at a time with their own options
+_ffmpeg_options_lock = Lock()
+
+
+class RtspFrameSource(CaptureFrameSource):
+    def __init__(
+            self,
+            rtsp_url: str,
+            fps=10,
+            output_size: Size = None,
+            backend="gstreamer",
+            decoder_threads=0,
+            latency_ms=200,
+            transport="udp",
+    ):
+        if backend not in CAPTURE_BACKENDS:
+            raise ValueError(f"unknown capture backend '{backend}', use one of {list(CAPTURE_BACKENDS)}")
+        if transport not in RTSP_TRANSPORTS:
+            raise ValueError(f"unknown RTSP transport '{transport}', use one of {list(RTSP_TRANSPORTS)}")
+
+        logger.info("Starting camera capture")
+        if backend == "gstreamer":
+            gstreamer_pipeline = GStreamerPipeline(
+                rtsp_url, fps, output_size, latency_ms, decoder_threads, transport=transport
+            ).build()
+            logger.info(f"Using GStreamer pipeline: '{gstreamer_pipeline}'")
+            super().__init__(gstreamer_pipeline, cv2.CAP_GSTREAMER, fps)
+            if self._capture.isOpened():
+                return
+            logger.warning("GStreamer pipeline could not be opened, falling back to FFMPEG")
+
+        # FFMPEG decodes full frames, they are scaled by the consumer
+        logger.info(f"Using FFMPEG capture of '{rtsp_url}' over {transport}")
+        options = f"rtsp_transport;{transport}|threads;{decoder_threads or 'auto'}"
+        with _ffmpeg_options_lock:
+            previous = os.environ.get("OPENCV_FFMPEG_CAPTURE_OPTIONS")
+            os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"] = options
+            try:
+                super().__init__(rtsp_url, cv2.CAP_FFMPEG, fps)
+            finally:
+                if previous is None:
+                    del os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"]
+                else:
+                    os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"] = previous
+        self._capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+
+class VideoFileFrameSource(FrameSource):
+    def __init__(self, path: str, realtime=True, loop=False):
+        self._path = path
+        self._loop = loop
+        self._capture = cv2.VideoCapture(path)
+        if not self._capture.isOpened():
+            raise FileNotFoundError(f"cannot open video '{path}'")
+
+        self._fps = self._capture.get(cv2.CAP_PROP_FPS) or 10.0
+        self._throttle = _Throttle(self._fps, realtime)
+        self._is_exhausted = False
+
+    @property
+    def fps(self) -> float:
+        return self._fps
+
+    @property
+    def is_exhausted(self) -> bool:
+        return self._is_exhausted
+
+    def read(self) -> Tuple[bool, Optional[np.ndarray]]:
+        if self._is_exhausted:
+            return False, None
+
+        self._throttle.wait()
+        result, frame = self._capture.read()
+        if not result and self._loop:
+            self._capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            result, frame = self._capture.read()
+        if not result:
+            self._is_exhausted = True
+        return result, frame
+
+    def release(self) -> None:
+        self._capture.release()
+
+
+class ImageSequenceFrameSource(FrameSource):
+    def __init__(self, pattern: str, fps=10.0, realtime=True, loop=False):
+        self._paths = sorted(glob.glob(pattern))
+        if not self._paths:
+            raise FileNotFoundError(f"no images match '{pattern}'")
+
+        self._fps = fps
+        self._loop = loop
+        self._throttle = _Throttle(fps, realtime)
+        self._index = 0
+
+    @property
+    def fps(self) -> float:
+        return self._fps
+
+    @property
+    def is_exhausted(self) -> bool:
+        return not self._loop and self._index >= len(self._paths)
+
+    def read(self) -> Tuple[bool, Optional[np.ndarray]]:
+        if self.is_exhausted:
+            return False, None
+
+        self._throttle.wait()
+        frame = cv2.imread(self._paths[self._index % len(self._paths)])
+        self._index += 1
+        return frame is not None, frame
+
+
+class ArrayFrameSource(FrameSource):
+    # frames already decoded in memory, measures the pipeline without any decoding cost
+    def __init__(self, frames: Sequence[np.ndarray], fps=10.0, realtime=False, count: int = None):
+        if len(frames) == 0:
+            raise ValueError("at least one frame is needed")
+
+        self._frames = frames
+        self._fps = fps
+        self._count = count
+        self._throttle = _Throttle(fps, realtime)
+        self._index = 0
+
+    @property
+    def fps(self) -> float:
+        return self._fps
+
+    @property
+    def is_exhausted(self) -> bool:
+        return self._count is not None and self._index >= self._count
+
+    def read(self) -> Tuple[bool, Optional[np.ndarray]]:
+        if self.is_exhausted:
+            return False, None
+
+        self._throttle.wait()
+        frame = self._frames[self._index % len(self._frames)]
+        self._index += 1
+        return True, frame
@@ -0,0 +1,135 @@
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from geomdl import fitting
+from scipy import spatial
+
+from server.analysis.types import Point
+
+logger = logging.getLogger(__name__)
+
+
+class LaneCurve:
+    # Interpolating B-spline through lane points. The curve is sampled and indexed by a KD-tree once per edit, queries
+    # take arrays of points and are answered by one tree query and NumPy interpolation.
+    _samples: np.ndarray
+    _tree: Optional[spatial.cKDTree]
+
+    def __init__(self, points: Sequence[Point] = (), sample_count=1000, degree=2):
+        if sample_count < 2:
+            raise ValueError("sample_count must be at least 2")
+
+        self._sample_count = sample_count
+        self._degree = degree
+        self._points = []
+        self._t = np.linspace(0, 1, num=sample_count, dtype=np.float64)
+        self._samples = np.empty((0, 2), dtype=np.float64)
+        self._tree = None
+        self.set_points(points)
+
+    @property
+    def points(self) -> List[Point]:
+        return list(self._points)
+
+    @property
+    def is_valid(self) -> bool:
+        return self._tree is not None
+
+    @property
+    def samples(self) -> np.ndarray:
+        return self._samples
+
+    def key(self) -> Tuple:
+        return tuple(p.to_tuple() for p in self._points), self._sample_count, self._degree
+
+    def set_points(self, points: Sequence[Point]) -> None:
+        self._points = list(points)
+        self._rebuild()
+
+    def add_points(self, points: Sequence[Point]) -> None:
+        self._points.extend(points)
+        self._rebuild()
+
+    def closest_point(self, points: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # for points of shape (N, 2) returns closest curve points (N, 2), their parameters t (N,) and distances (N,)
+        self._check_valid()
+        points = np.asarray(points, dtype=np.float64).reshape((-1, 2))
+        distances, indices = self._tree.query(points)
+        return self._samples[indices], self._t[indices], distances
+
+    def evaluate(self, t: np.ndarray) -> np.ndarray:
+        # curve points (N, 2) for parameters t (N,), linearly interpolated between samples
+        self._check_valid()
+        t = np.clip(np.asarray(t, dtype=np.float64), 0.0, 1.0)
+        position = t * (self._sample_count - 1)
+        first = np.minimum(position.astype(np.intp), self._sample_count - 2)
+        fraction = (position - first)[..., np.newaxis]
+        return self._samples[first] * (1 - fraction) + self._samples[first + 1] * fraction
+
+    def _check_valid(self) -> None:
+        if not self.is_valid:
+            raise ValueError(f"lane needs at least {self._degree + 1} points, it has {len(self._points)}")
+
+    def _rebuild(self) -> None:
+        if len(self._points) <= self._degree:
+            self._samples = np.empty((0, 2), dtype=np.float64)
+            self._tree = None
+            return
+
+        curve = fitting.interpolate_curve([point.to_tuple() for point in self._points], self._degree)
+        curve.sample_size = self._sample_count
+        self._samples = np.array(curve.evalpts, dtype=np.float64)
+        self._tree = spatial.cKDTree(self._samples)
+        logger.debug(f"Rebuilt lane of {len(self._points)} points")
+
+
+class LaneModel:
+    # Lanes of one camera in camera image coordinates. Lanes are replaced as a whole, unchanged ones keep their
+    # sampled curve and tree.
+    _lanes: Tuple[LaneCurve, ...]
+
+    def __init__(self, sample_count=1000, degree=2):
+        self._sample_count = sample_count
+        self._degree = degree
+        self._lanes = ()
+
+    @property
+    def lanes(self) -> List[List[Point]]:
+        return [lane.points for lane in self._lanes]
+
+    @lanes.setter
+    def lanes(self, lanes: Sequence[Sequence[Point]]) -> None:
+        cached: Dict[Tuple, LaneCurve] = {lane.key(): lane for lane in self._lanes}
+        new_lanes = []
+        for points in lanes:
+            key = tuple(p.to_tuple() for p in points), self._sample_count, self._degree
+            lane = cached.get(key)
+            if lane is None:
+                lane = LaneCurve(points, self._sample_count, self._degree)
+            new_lanes.append(lane)
+        self._lanes = tuple(new_lanes)
+
+    def lane(self, index: int) -> LaneCurve:
+        if not 0 <= index < len(self._lanes):
+            raise IndexError(f"lane {index} does not exist, there are {len(self._lanes)} lanes")
+        return self._lanes[index]
+
+    def closest_point(self, lane_index: int, points: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        return self.lane(lane_index).closest_point(points)
+
+    def map_points(self, source_index: int, target_index: int, points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # projects points to the source lane and returns points with the same parameter t on the target lane
+        _, t, _ = self.closest_point(source_index, points)
+        return self.lane(target_index).evaluate(t), t
+
+    def row_quadrilaterals(self, first_index: int, second_index: int, t_edges: np.ndarray) -> np.ndarray:
+        # spots of a curved row between two lanes, M edges give M - 1 quadrilaterals of shape (4, 2) in the
+        # clockwise order of Rectangle.vertices
+        t_edges = np.asarray(t_edges, dtype=np.float64)
+        if len(t_edges) < 2:
+            raise ValueError("at least 2 edges are needed")
+
+        first = self.lane(first_index).evaluate(t_edges)
+        second = self.lane(second_index).evaluate(t_edges)
+        return np.stack((first[:-1], first[1:], second[1:], second[:-1]), axis=1)
@@ -0,0 +1,81 @@
+import logging
+from typing import Iterable, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from server.analysis.types import Point, Size
+
+logger = logging.getLogger(__name__)
+
+
+class MotionDetector:
+    # Compares a small grey copy of every frame with the last fully analyzed one inside the ROI polygons. Slow changes like
+    # dusk accumulate against the reference until they trigger a refresh, max_interval forces one in any case.
+    _reference: Optional[np.ndarray]
+
+    def __init__(
+            self,
+            camera_size: Size,
+            sample_size=Size(160, 90),
+            pixel_threshold=12,
+            changed_fraction=0.002,
+            max_interval=30.0,
+    ):
+        self._camera_size = camera_size
+        self._sample_size = sample_size
+        self._pixel_threshold = pixel_threshold
+        self._changed_fraction = changed_fraction
+        self.max_interval = max_interval
+
+        self._colour_sample = np.empty((sample_size.height, sample_size.width, 3), dtype=np.uint8)
+        self._sample = np.empty((sample_size.height, sample_size.width), dtype=np.uint8)
+        self._difference = np.empty_like(self._sample)
+        self._mask = np.empty_like(self._sample)
+        self._mask_area = 0
+        self._polygons_key = None
+        self._reference = None
+        self._last_refresh = 0.0
+        self._refresh_requested = True
+        self.refreshed_frames = 0
+        self.skipped_frames = 0
+
+    def force_refresh(self) -> None:
+        # next frame is analyzed fully, used when settings of the analysis change
+        self._refresh_requested = True
+
+    def changed(self, image: np.ndarray, polygons: Iterable[Iterable[Point]], timestamp: float) -> bool:
+        polygons_key = tuple(tuple(p.to_tuple() for p in polygon) for polygon in polygons)
+        if polygons_key != self._polygons_key:
+            self._build_mask(polygons_key)
+            self._polygons_key = polygons_key
+            self._refresh_requested = True
+
+        cv2.resize(image, self._sample_size.to_tuple(), dst=self._colour_sample, interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(self._colour_sample, cv2.COLOR_BGR2GRAY, dst=self._sample)
+
+        if not self._refresh_requested and timestamp - self._last_refresh < self.max_interval:
+            cv2.absdiff(self._sample, self._reference, dst=self._difference)
+            cv2.threshold(self._difference, self._pixel_threshold, 255, cv2.THRESH_BINARY, dst=self._difference)
+            cv2.bitwise_and(self._difference, self._mask, dst=self._difference)
+            if cv2.countNonZero(self._difference) <= self._changed_fraction * self._mask_area:
+                self.skipped_frames += 1
+                return False
+
+        if self._reference is None:
+            self._reference = np.empty_like(self._sample)
+        np.copyto(self._reference, self._sample)
+        self._last_refresh = timestamp
+        self._refresh_requested = False
+        self.refreshed_frames += 1
+        return True
+
+    def _build_mask(self, polygons_key: Tuple[Tuple[Tuple[int, int], ...], ...]) -> None:
+        scale = np.array([
+            self._sample_size.width / self._camera_size.width,
+            self._sample_size.height / self._camera_size.height,
+        ])
+        polygons = [np.round(np.array(key, dtype=np.float64) * scale).astype(np.int32) for key in polygons_key]
+        self._mask.fill(0)
+        cv2.fillPoly(self._mask, polygons, 255)
+        self._mask_area = max(cv2.countNonZero(self._mask), 1)
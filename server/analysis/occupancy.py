@@ -0,0 +1,125 @@
+from dataclasses import dataclass
+from typing import List, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from server.analysis.types import Rectangle, Size
+
+
+@dataclass
+class OccupancyResult:
+    timestamp: float
+    occupied: np.ndarray
+    confidence: np.ndarray
+
+
+FEATURE_NAMES = ("edge_strength", "edge_density", "contrast", "saturation")
+
+# hand tuned for empty asphalt versus cars, empty spots are smooth, grey and low contrast
+DEFAULT_WEIGHTS = np.array([14.0, 6.0, 5.0, 4.0], dtype=np.float32)
+DEFAULT_BIAS = -4.5
+
+
+class OccupancyClassifier:
+    # All spots are resampled to the same patch size through one precomputed gather index, so features of every
+    # spot are computed and classified by a few whole-batch NumPy operations without per-spot Python loops.
+    _indices: np.ndarray
+
+    def __init__(
+            self,
+            spots: Sequence[Rectangle],
+            roi_size: Size,
+            patch_size=Size(16, 16),
+            weights: np.ndarray = DEFAULT_WEIGHTS,
+            bias: float = DEFAULT_BIAS,
+            edge_threshold=20.0,
+    ):
+        if len(weights) != len(FEATURE_NAMES):
+            raise ValueError(f"expected {len(FEATURE_NAMES)} weights, got {len(weights)}")
+
+        self._spots = list(spots)
+        self._roi_size = roi_size
+        self._patch_size = patch_size
+        self._weights = np.asarray(weights, dtype=np.float32)
+        self._bias = np.float32(bias)
+        self._edge_threshold = edge_threshold
+        self._indices = self._gather_indices(self._spots, roi_size, patch_size)
+
+        spot_count = len(self._spots)
+        self._gray = np.empty((roi_size.height, roi_size.width), dtype=np.uint8)
+        self._patches = np.empty((spot_count, patch_size.height, patch_size.width), dtype=np.uint8)
+        self._colour_patches = np.empty((spot_count, patch_size.height, patch_size.width, 3), dtype=np.uint8)
+        self._features = np.empty((spot_count, len(FEATURE_NAMES)), dtype=np.float32)
+
+    @property
+    def spots(self) -> List[Rectangle]:
+        return self._spots
+
+    @property
+    def roi_size(self) -> Size:
+        return self._roi_size
+
+    @staticmethod
+    def _gather_indices(spots: Sequence[Rectangle], roi_size: Size, patch_size: Size) -> np.ndarray:
+        # flat ROI pixel index of every patch pixel of every spot, shape (spots, patch height, patch width)
+        if not spots:
+            return np.empty((0, patch_size.height, patch_size.width), dtype=np.intp)
+
+        boxes = np.array(
+            [(s.top_left.x, s.top_left.y, s.size.width, s.size.height) for s in spots], dtype=np.float32
+        )
+        x, y, width, height = boxes.T
+        patch_xs = (np.arange(patch_size.width, dtype=np.float32) + 0.5) / patch_size.width
+        patch_ys = (np.arange(patch_size.height, dtype=np.float32) + 0.5) / patch_size.height
+        xs = np.clip(x[:, np.newaxis] + patch_xs[np.newaxis, :] * width[:, np.newaxis], 0, roi_size.width - 1)
+        ys = np.clip(y[:, np.newaxis] + patch_ys[np.newaxis, :] * height[:, np.newaxis], 0, roi_size.height - 1)
+        return ys.astype(np.intp)[:, :, np.newaxis] * roi_size.width + xs.astype(np.intp)[:, np.newaxis, :]
+
+    def features(self, roi: np.ndarray) -> np.ndarray:
+        if roi.shape[:2] != (self._roi_size.height, self._roi_size.width):
+            raise ValueError(f"expected ROI of size {self._roi_size}, got {roi.shape[1]}x{roi.shape[0]}")
+
+        cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY, dst=self._gray)
+        np.take(self._gray.reshape(-1), self._indices, out=self._patches, mode="clip")
+        np.take(roi.reshape(-1, 3), self._indices, axis=0, out=self._colour_patches, mode="clip")
+
+        patches = self._patches.astype(np.float32)
+        gradient_x = np.abs(np.diff(patches, axis=2))
+        gradient_y = np.abs(np.diff(patches, axis=1))
+        self._features[:, 0] = (gradient_x.mean(axis=(1, 2)) + gradient_y.mean(axis=(1, 2))) / 255
+        self._features[:, 1] = (
+            (gradient_x > self._edge_threshold).mean(axis=(1, 2)) +
+            (gradient_y > self._edge_threshold).mean(axis=(1, 2))
+        ) / 2
+        self._features[:, 2] = patches.std(axis=(1, 2)) / 128
+        self._features[:, 3] = np.ptp(self._colour_patches, axis=3).mean(axis=(1, 2)) / 255
+        return self._features
+
+    def classify(self, roi: np.ndarray, timestamp: float) -> OccupancyResult:
+        if not self._spots:
+            return OccupancyResult(timestamp, np.empty(0, dtype=bool), np.empty(0, dtype=np.float32))
+
+        scores = self.features(roi) @ self._weights + self._bias
+        probability = 1 / (1 + np.exp(-scores))
+        occupied = probability >= 0.5
+        confidence = np.where(occupied, probability, 1 - probability).astype(np.float32)
+        return OccupancyResult(timestamp, occupied, confidence)
+
+
+def fit_weights(
+        features: np.ndarray,
+        occupied: np.ndarray,
+        iterations=500,
+        learning_rate=0.5,
+) -> Tuple[np.ndarray, float]:
+    # plain batch gradient descent of logistic regression, meant for offline calibration on labelled ROIs
+    weights = np.zeros(features.shape[1], dtype=np.float32)
+    bias = 0.0
+    labels = occupied.astype(np.float32)
+    for _ in range(iterations):
+        probability = 1 / (1 + np.exp(-(features @ weights + bias)))
+        error = probability - labels
+        weights -= learning_rate * (features.T @ error) / len(labels)
+        bias -= learning_rate * float(error.mean())
+    return weights, bias
@@ -0,0 +1,104 @@
+import logging
+import time
+from collections import deque
+from threading import Thread, Condition, Lock
+from typing import Callable, Deque, Generic, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class HandoffSlot(Generic[T]):
+    # Single item buffer between two pipeline stages. A newer item replaces the one which was not taken yet, so
+    # the consumer always gets the latest item and the producer never waits. Replaced and released items are kept
+    # as spares, so the producer can reuse their buffers instead of allocating new ones.
+    _item: Optional[T]
+    _spares: Deque[T]
+
+    def __init__(self):
+        self._condition = Condition()
+        self._item = None
+        self._spares = deque()
+        self._is_closed = False
+        self.replaced = 0
+
+    def put(self, item: T) -> None:
+        with self._condition:
+            if self._item is not None:
+                self._spares.append(self._item)
+                self.replaced += 1
+            self._item = item
+            self._condition.notify()
+
+    def get(self, timeout: float = None) -> Optional[T]:
+        with self._condition:
+            self._condition.wait_for(lambda: self._item is not None or self._is_closed, timeout)
+            item, self._item = self._item, None
+            return item
+
+    def release(self, item: T) -> None:
+        with self._condition:
+            self._spares.append(item)
+
+    def spare(self) -> Optional[T]:
+        with self._condition:
+            return self._spares.popleft() if self._spares else None
+
+    def close(self) -> None:
+        with self._condition:
+            self._is_closed = True
+            self._condition.notify_all()
+
+
+class ThroughputMeter:
+    def __init__(self, window=100):
+        self._lock = Lock()
+        self._window = window
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._count = 0
+        self._rate = 0.0
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    def tick(self) -> bool:
+        # returns True when a new rate was measured
+        with self._lock:
+            self._count += 1
+            self._window_count += 1
+            if self._window_count < self._window:
+                return False
+
+            now = time.monotonic()
+            time_delta = now - self._window_start
+            self._rate = self._window_count / time_delta if time_delta > 0 else 0.0
+            self._window_start = now
+            self._window_count = 0
+            return True
+
+
+class PipelineStage(Thread):
+    def __init__(self, name: str, step: Callable[[], bool]):
+        super().__init__(name=name, daemon=True)
+        self._step = step
+        self._is_running = False
+        self.throughput = ThroughputMeter()
+
+    def start(self) -> None:
+        self._is_running = True
+        super().start()
+
+    def stop(self) -> None:
+        self._is_running = False
+
+    def run(self) -> None:
+        while self._is_running:
+            if self._step() and self.throughput.tick():
+                logger.debug(f"Stage '{self.name}' runs at {self.throughput.rate:.2f} FPS")
@@ -1,5 +1,7 @@
 import logging
-from typing import Tuple, Iterable
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Tuple, Iterable, Optional, Sequence, List
 import cv2
 import numpy as np
 
@@ -9,17 +11,147 @@ logger = logging.getLogger(__name__)
 
 
 class RoiMaker:
-    _image: np.ndarray
+    _maps: Optional[Tuple[np.ndarray, np.ndarray]]
+    _output_image: np.ndarray
 
-    def __init__(self, image: np.ndarray, output_size: Size):
-        self._image = image
-        self._image_size = Size(self._image.shape[1], self._image.shape[0])
+    def __init__(self, output_size: Size):
         self._output_size = output_size
-        output_rectangle = Rectangle(Point(0, 0), output_size)
-        self._output_polygon = np.array([vertex.to_tuple() for vertex in output_rectangle.vertices()], dtype=np.float32)
-
-    def roi(self, polygon_of_interest: Iterable[Point]) -> np.ndarray:
-        points = [[p.x, p.y] for p in polygon_of_interest]
-        input_polygon = np.array(points, dtype=np.float32)
-        m = cv2.getPerspectiveTransform(input_polygon, self._output_polygon)
-        return cv2.warpPerspective(self._image, m, self._image_size.to_tuple())[self._output_size.np_slice()]
+        self._polygon_key = None
+        self._maps = None
+        self._output_image = np.empty((output_size.height, output_size.width, 3), dtype=np.uint8)
+
+    @property
+    def output_size(self) -> Size:
+        return self._output_size
+
+    def roi(self, image: np.ndarray, polygon_of_interest: Iterable[Point], dst: np.ndarray = None) -> np.ndarray:
+        # remap maps are cached for the last polygon, without dst the returned buffer is overwritten by the next call
+        polygon_key = tuple(p.to_tuple() for p in polygon_of_interest)
+        if polygon_key != self._polygon_key:
+            self._maps = self._build_maps(polygon_key)
+            self._polygon_key = polygon_key
+
+        if dst is None:
+            dst = self._output_buffer(image)
+
+        map1, map2 = self._maps
+        return cv2.remap(image, map1, map2, cv2.INTER_LINEAR, dst=dst)
+
+    def _output_buffer(self, image: np.ndarray) -> np.ndarray:
+        if image.shape[2:] != self._output_image.shape[2:] or image.dtype != self._output_image.dtype:
+            self._output_image = np.empty(
+                (self._output_size.height, self._output_size.width, *image.shape[2:]), dtype=image.dtype
+            )
+        return self._output_image
+
+    def _build_maps(self, polygon_key: Tuple[Tuple[int, int], ...]) -> Tuple[np.ndarray, np.ndarray]:
+        logger.debug(f"Rebuilding ROI maps for polygon {polygon_key}")
+        source = perspective_source_map(polygon_key, self._output_size)
+        return cv2.convertMaps(source, None, cv2.CV_16SC2)
+
+
+def perspective_source_map(polygon_key: Tuple[Tuple[int, int], ...], output_size: Size) -> np.ndarray:
+    # source image coordinates (height, width, 2) of every output pixel of the perspective warp of polygon
+    output_rectangle = Rectangle(Point(0, 0), output_size)
+    output_polygon = np.array([vertex.to_tuple() for vertex in output_rectangle.vertices()], dtype=np.float32)
+    inverse = cv2.getPerspectiveTransform(output_polygon, np.array(polygon_key, dtype=np.float32))
+
+    xs, ys = np.meshgrid(
+        np.arange(output_size.width, dtype=np.float32),
+        np.arange(output_size.height, dtype=np.float32),
+    )
+    grid = np.stack((xs, ys), axis=-1).reshape((1, -1, 2))
+    source = cv2.perspectiveTransform(grid, inverse).reshape((output_size.height, output_size.width, 2))
+    return source.astype(np.float32)
+
+
+@dataclass
+class RoiRow:
+    name: str
+    polygon: List[Point]
+    size: Size
+
+    def key(self) -> Tuple:
+        return tuple(p.to_tuple() for p in self.polygon), self.size.to_tuple()
+
+
+def atlas_layout(rows: Sequence[RoiRow]) -> Tuple[Size, Dict[str, Rectangle]]:
+    # rows are stacked from top to bottom, atlas is as wide as the widest row
+    if not rows:
+        raise ValueError("at least one row is needed")
+    names = [row.name for row in rows]
+    if len(set(names)) != len(names):
+        raise ValueError(f"row names must be unique, got {names}")
+    for row in rows:
+        if row.size.width < 1 or row.size.height < 1:
+            raise ValueError(f"row '{row.name}' has empty size {row.size.width}x{row.size.height}")
+
+    placement = dict()
+    top = 0
+    for row in rows:
+        placement[row.name] = Rectangle(Point(0, top), row.size)
+        top += row.size.height
+    return Size(max(row.size.width for row in rows), top), placement
+
+
+class RoiAtlas:
+    # Several rows warped from one frame by a single remap. Per row source maps are cached by polygon and size, so
+    # editing one row recomputes only its map, and they are packed into one atlas map. Pixels right of narrower rows
+    # are black. The atlas is encoded and classified as one image, rows are zero copy views into it.
+    _row_maps: "OrderedDict[Tuple, np.ndarray]"
+
+    def __init__(self, cached_rows=16):
+        self._cached_rows = cached_rows
+        self._row_maps = OrderedDict()
+        self._rows = []
+        self._size = Size(0, 0)
+        self._placement = dict()
+        self._maps = None
+
+    @property
+    def rows(self) -> List[RoiRow]:
+        return list(self._rows)
+
+    @property
+    def size(self) -> Size:
+        return self._size
+
+    @property
+    def placement(self) -> Dict[str, Rectangle]:
+        return self._placement
+
+    def set_rows(self, rows: Sequence[RoiRow]) -> None:
+        size, placement = atlas_layout(rows)
+        source = np.full((size.height, size.width, 2), -1, dtype=np.float32)
+        for row in rows:
+            rectangle = placement[row.name]
+            source[rectangle.top_left.y:rectangle.top_left.y + row.size.height, :row.size.width] = self._row_map(row)
+        self._maps = cv2.convertMaps(source, None, cv2.CV_16SC2)
+        self._rows = list(rows)
+        self._size = size
+        self._placement = placement
+
+    def warp(self, image: np.ndarray, dst: np.ndarray = None) -> np.ndarray:
+        if self._maps is None:
+            raise AttributeError("RoiAtlas has no rows, set them first")
+        map1, map2 = self._maps
+        return cv2.remap(image, map1, map2, cv2.INTER_LINEAR, dst=dst, borderMode=cv2.BORDER_CONSTANT)
+
+    def row_view(self, atlas_image: np.ndarray, name: str) -> np.ndarray:
+        rectangle = self._placement[name]
+        return atlas_image[
+            rectangle.top_left.y:rectangle.top_left.y + rectangle.size.height,
+            rectangle.top_left.x:rectangle.top_left.x + rectangle.size.width,
+        ]
+
+    def _row_map(self, row: RoiRow) -> np.ndarray:
+        key = row.key()
+        source = self._row_maps.get(key)
+        if source is None:
+            logger.debug(f"Building ROI map of row '{row.name}'")
+            source = perspective_source_map(key[0], row.size)
+            self._row_maps[key] = source
+            if len(self._row_maps) > self._cached_rows:
+                self._row_maps.popitem(last=False)
+        self._row_maps.move_to_end(key)
+        return source
@@ -0,0 +1,77 @@
+from typing import Optional
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+from server.analysis.lanes import LaneCurve
+from server.analysis.types import Size
+
+
+def window_starts(start: int, end: int, steps: int) -> np.ndarray:
+    # left edges of steps windows spread evenly from start to end, both included
+    if steps <= 0:
+        raise ValueError("steps must be greater than 0")
+    return np.round(np.linspace(start, end, num=steps)).astype(np.intp)
+
+
+def horizontal_windows(image: np.ndarray, size: Size, x: int, stride: int, count: int, y=0) -> np.ndarray:
+    # Read only view of count windows of one image row with shape (count, height, width, ...). No pixel is copied,
+    # neighbouring windows share memory, so the view must not be written to.
+    if count <= 0:
+        raise ValueError("count must be greater than 0")
+    if stride <= 0:
+        raise ValueError("stride must be greater than 0")
+    last_x = x + stride * (count - 1) + size.width
+    if x < 0 or y < 0 or last_x > image.shape[1] or y + size.height > image.shape[0]:
+        raise ValueError(f"windows up to x={last_x}, y={y + size.height} do not fit image {image.shape[1::-1]}")
+
+    origin = image[y:, x:]
+    return as_strided(
+        origin,
+        shape=(count, size.height, size.width, *image.shape[2:]),
+        strides=(stride * image.strides[1], *image.strides),
+        writeable=False,
+    )
+
+
+def gather_windows(
+        image: np.ndarray,
+        top_lefts: np.ndarray,
+        size: Size,
+        out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    # Copies windows at arbitrary integer positions (N, 2) of x, y into one array (N, height, width, ...) by a single
+    # gather, parts of windows outside of the image repeat its border pixels.
+    top_lefts = np.asarray(top_lefts, dtype=np.intp).reshape((-1, 2))
+    height, width = image.shape[:2]
+    ys = np.clip(top_lefts[:, 1, np.newaxis] + np.arange(size.height), 0, height - 1)
+    xs = np.clip(top_lefts[:, 0, np.newaxis] + np.arange(size.width), 0, width - 1)
+    indices = ys[:, :, np.newaxis] * width + xs[:, np.newaxis, :]
+
+    pixels = image.reshape((height * width, *image.shape[2:]))
+    if out is None:
+        out = np.empty((len(top_lefts), size.height, size.width, *image.shape[2:]), dtype=image.dtype)
+    return np.take(pixels, indices, axis=0, out=out)
+
+
+def row_windows(image: np.ndarray, size: Size, start: int, end: int, steps: int, y=0) -> np.ndarray:
+    # strided view when the windows are evenly spaced by whole pixels, gathered copy otherwise
+    starts = window_starts(start, end, steps)
+    strides = np.diff(starts)
+    if steps == 1 or (strides[0] > 0 and np.all(strides == strides[0])):
+        return horizontal_windows(image, size, int(starts[0]), int(strides[0]) if steps > 1 else 1, steps, y)
+    top_lefts = np.stack((starts, np.full(steps, y)), axis=1)
+    return gather_windows(image, top_lefts, size)
+
+
+def curve_windows(
+        image: np.ndarray,
+        curve: LaneCurve,
+        size: Size,
+        t: np.ndarray,
+        out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    # windows centred on curve points at parameters t, the curve has to be in coordinates of the image
+    centers = curve.evaluate(t)
+    top_lefts = np.round(centers - (size.width / 2, size.height / 2)).astype(np.intp)
+    return gather_windows(image, top_lefts, size, out=out)
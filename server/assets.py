@@ -0,0 +1,128 @@
+import gzip
+import hashlib
+import logging
+import mimetypes
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional
+
+from aiohttp import web
+from aiohttp.web_request import Request
+from aiohttp.web_response import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# bundler puts content hash into file names, such files never change under the same name
+HASHED_NAME = re.compile(r"\.[0-9a-f]{8,}\.")
+COMPRESSIBLE_TYPES = re.compile(r"^(text/|application/(javascript|json|xml|manifest\+json)|image/svg\+xml)")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+
+@dataclass(frozen=True)
+class AssetVariant:
+    body: bytes
+    etag: str
+
+
+@dataclass(frozen=True)
+class Asset:
+    content_type: str
+    cache_control: str
+    variants: Dict[str, AssetVariant]  # by content encoding, "identity" is always present
+
+
+class AssetCache:
+    # Static files of the frontend loaded once at startup with precompressed variants and strong ETags, requests
+    # are answered from memory without touching the filesystem. Rebuilt frontend is served after server restart.
+    _assets: Dict[str, Asset]
+
+    def __init__(self, root: Path, min_compress_size=256):
+        self._root = root
+        self._min_compress_size = min_compress_size
+        self._assets = dict()
+
+    def __len__(self) -> int:
+        return len(self._assets)
+
+    def load(self) -> None:
+        if not self._root.is_dir():
+            logger.warning(f"Static folder '{self._root}' does not exist, no frontend is served")
+            return
+
+        assets = dict()
+        for path in sorted(self._root.rglob("*")):
+            if path.is_file():
+                assets[path.relative_to(self._root).as_posix()] = self._load_asset(path)
+        self._assets = assets
+
+        identity_size = sum(len(asset.variants["identity"].body) for asset in assets.values())
+        logger.info(f"Loaded {len(assets)} static files of {identity_size / 1024:.0f} kB, brotli: {brotli is not None}")
+
+    def get(self, path: str) -> Optional[Asset]:
+        # path relative to the static folder, directories are served by their index.html
+        path = path.strip("/")
+        asset = self._assets.get(path)
+        if asset is None:
+            asset = self._assets.get(f"{path}/index.html" if path else "index.html")
+        return asset
+
+    def response(self, request: Request, asset: Asset) -> Response:
+        encoding = _select_encoding(request.headers.get("Accept-Encoding", ""), asset.variants)
+        variant = asset.variants[encoding]
+        headers = {
+            "ETag": variant.etag,
+            "Cache-Control": asset.cache_control,
+            "Vary": "Accept-Encoding",
+        }
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+
+        if _etag_matches(request.headers.get("If-None-Match"), variant.etag):
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=variant.body, content_type=asset.content_type, headers=headers)
+
+    def _load_asset(self, path: Path) -> Asset:
+        body = path.read_bytes()
+        content_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+
+        variants = {"identity": AssetVariant(body, f"\"{digest}\"")}
+        if len(body) >= self._min_compress_size and COMPRESSIBLE_TYPES.match(content_type):
+            compressed = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                compressed["br"] = brotli.compress(body, quality=11)
+            for encoding, encoded_body in compressed.items():
+                if len(encoded_body) < len(body):
+                    variants[encoding] = AssetVariant(encoded_body, f"\"{digest}-{encoding}\"")
+
+        cache_control = IMMUTABLE_CACHE_CONTROL if HASHED_NAME.search(path.name) else REVALIDATE_CACHE_CONTROL
+        return Asset(content_type, cache_control, variants)
+
+
+def _select_encoding(accept_encoding: str, variants: Dict[str, AssetVariant]) -> str:
+    accepted = set()
+    for item in accept_encoding.split(","):
+        coding, *parameters = [part.strip() for part in item.split(";")]
+        if not any(parameter.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000") for parameter in parameters):
+            accepted.add(coding.lower())
+
+    for encoding in ("br", "gzip"):
+        if encoding in variants and encoding in accepted:
+            return encoding
+    return "identity"
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    # weak comparison as required for If-None-Match
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
@@ -0,0 +1,60 @@
+import argparse
+import time
+from typing import Dict, Optional
+
+import cv2
+import numpy as np
+
+from server.analysis.compressor.encoding import EncodingProfile, DEFAULT_ENCODING_PROFILES
+
+
+def synthetic_image(width=1920 // 2, height=1080 // 2) -> np.ndarray:
+    # gradient with some noise is closer to a camera frame than a flat or purely random image
+    xs = np.linspace(0, 255, width, dtype=np.float32)
+    ys = np.linspace(0, 255, height, dtype=np.float32)
+    image = np.empty((height, width, 3), dtype=np.float32)
+    image[..., 0] = xs[np.newaxis, :]
+    image[..., 1] = ys[:, np.newaxis]
+    image[..., 2] = (xs[np.newaxis, :] + ys[:, np.newaxis]) / 2
+    image += np.random.default_rng(0).normal(0, 8, image.shape)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def benchmark_profile(image: np.ndarray, profile: EncodingProfile, repeats: int) -> Dict[str, float]:
+    params = profile.imencode_params()
+    if profile.scale != 1.0:
+        image = cv2.resize(image, None, fx=profile.scale, fy=profile.scale, interpolation=cv2.INTER_AREA)
+
+    durations = []
+    size = 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        _, buff = cv2.imencode(".jpg", image, params)
+        durations.append(time.perf_counter() - start)
+        size = buff.size
+    return {
+        "mean_ms": 1000 * float(np.mean(durations)),
+        "p95_ms": 1000 * float(np.percentile(durations, 95)),
+        "bytes": size,
+    }
+
+
+def main(image_path: Optional[str], repeats: int) -> None:
+    image = synthetic_image() if image_path is None else cv2.imread(image_path)
+    if image is None:
+        raise FileNotFoundError(f"cannot read image '{image_path}'")
+
+    profiles = {"legacy": EncodingProfile(quality=100, chroma_subsampling="444"), **DEFAULT_ENCODING_PROFILES}
+    print(f"Image {image.shape[1]}x{image.shape[0]}, {repeats} repeats")
+    print(f"{'profile':<12}{'mean ms':>10}{'p95 ms':>10}{'bytes':>12}")
+    for name, profile in profiles.items():
+        result = benchmark_profile(image, profile, repeats)
+        print(f"{name:<12}{result['mean_ms']:>10.2f}{result['p95_ms']:>10.2f}{result['bytes']:>12}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="JPEG encoding time and size per encoding profile")
+    parser.add_argument("image", nargs="?", help="image to encode, synthetic frame is used if omitted")
+    parser.add_argument("--repeats", type=int, default=50)
+    arguments = parser.parse_args()
+    main(arguments.image, arguments.repeats)
@@ -0,0 +1,106 @@
+import argparse
+import asyncio
+import tempfile
+import time
+from types import SimpleNamespace
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import aiohttp
+import cv2
+import numpy as np
+from aiohttp import web
+
+from server.__main__ import PoiHandler
+from server.analysis.analyzer import default_poi
+from server.benchmark.encoding import synthetic_image
+from server.benchmark.pipeline import latency_summary, print_report
+from server.camera import CameraConfig, CameraRegistry, ISOLATION_MODES
+from server.server import Server
+
+PORT = 8090
+
+
+def write_frames(folder: Path, count: int) -> str:
+    # every frame differs, so motion gating would not skip any of them anyway
+    rng = np.random.default_rng(0)
+    base = synthetic_image()
+    for index in range(count):
+        frame = np.clip(base.astype(np.int16) + rng.integers(-40, 40, base.shape), 0, 255).astype(np.uint8)
+        cv2.imwrite(str(folder / f"{index:04}.jpg"), frame)
+    return str(folder / "*.jpg")
+
+
+async def poi_client(session: aiohttp.ClientSession, url: str, deadline: float, durations: List[float]) -> None:
+    points = {"points": [{"x": 0, "y": 0}, {"x": 900, "y": 0}, {"x": 900, "y": 500}, {"x": 0, "y": 500}]}
+    request_index = 0
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        if request_index % 10 == 9:
+            async with session.post(url, json=points) as response:
+                await response.read()
+        else:
+            async with session.get(url) as response:
+                await response.read()
+        durations.append(time.perf_counter() - start)
+        request_index += 1
+        await asyncio.sleep(0.01)
+
+
+async def benchmark_poi(isolation: Optional[str], frames: str, clients: int, duration: float) -> Dict[str, float]:
+    # isolation None measures the server without any camera
+    server = Server()
+    cameras = CameraRegistry()
+    config = CameraConfig(
+        "benchmark", frames, source_type="images", realtime=False, motion_gating=False,
+        isolation=isolation or "process",
+    )
+    streams = {name: server.add_mjpeg_stream(f"/mjpeg/{name}") for name in config.output_images_names}
+    if isolation is None:
+        camera = SimpleNamespace(poi=default_poi(config.camera_size))
+    else:
+        camera = cameras.add(config, streams)
+    server.add_handler("/api/v1/poi", PoiHandler(camera))
+    server.setup()
+
+    runner = web.AppRunner(server.app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+    if isolation is not None:
+        cameras.start()
+        await asyncio.sleep(3)  # encoder processes start and the pipeline warms up
+
+    durations = []
+    start_sequence = streams["main"].sequence
+    start = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(
+            poi_client(session, f"http://127.0.0.1:{PORT}/api/v1/poi", start + duration, durations)
+            for _ in range(clients)
+        ))
+    elapsed = time.perf_counter() - start
+
+    result = latency_summary(durations)
+    result["max_ms"] = 1000 * max(durations)
+    result["requests"] = len(durations)
+    result["main_fps"] = (streams["main"].sequence - start_sequence) / elapsed
+    if isolation is not None:
+        await asyncio.get_running_loop().run_in_executor(None, cameras.stop)
+    await runner.cleanup()
+    return result
+
+
+def main(arguments: argparse.Namespace) -> None:
+    with tempfile.TemporaryDirectory() as folder:
+        frames = write_frames(Path(folder), arguments.frames)
+        for isolation in (None, *ISOLATION_MODES):
+            result = asyncio.run(benchmark_poi(isolation, frames, arguments.clients, arguments.duration))
+            print_report(f"/api/v1/poi latency, analysis: {isolation or 'none'}", result)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="REST latency while the analysis runs at full load")
+    parser.add_argument("--frames", type=int, default=20, help="distinct frames of the looped image sequence")
+    parser.add_argument("--clients", type=int, default=10, help="concurrent REST clients")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of measurement per mode")
+    main(parser.parse_args())
@@ -0,0 +1,298 @@
+import argparse
+import asyncio
+import resource
+import struct
+import threading
+import time
+from typing import Dict, List
+
+import aiohttp
+import cv2
+import numpy as np
+from aiohttp import web
+
+from server.analysis.analyzer import ImageAnalyzer
+from server.analysis.compressor import CompressorPool
+from server.analysis.compressor.encoding import DEFAULT_ENCODING_PROFILES
+from server.analysis.frame_source import FrameSource, ArrayFrameSource, VideoFileFrameSource, ImageSequenceFrameSource
+from server.analysis.roi_maker import RoiMaker, RoiAtlas, RoiRow
+from server.analysis.types import Point, Size
+from server.benchmark.encoding import synthetic_image
+from server.server import Server, MJPEG_BOUNDARY
+
+
+def latency_summary(durations: List[float]) -> Dict[str, float]:
+    if not durations:
+        return {"mean_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0}
+    durations_ms = 1000 * np.array(durations)
+    return {
+        "mean_ms": float(durations_ms.mean()),
+        "p50_ms": float(np.percentile(durations_ms, 50)),
+        "p95_ms": float(np.percentile(durations_ms, 95)),
+        "p99_ms": float(np.percentile(durations_ms, 99)),
+    }
+
+
+def peak_rss_mb() -> Dict[str, float]:
+    # ru_maxrss is in kilobytes on Linux, children are the encoder processes
+    return {
+        "self_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "children_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+def load_frames(source: FrameSource, count: int, size: Size) -> List[np.ndarray]:
+    frames = []
+    while len(frames) < count and not source.is_exhausted:
+        result, frame = source.read()
+        if result:
+            frames.append(cv2.resize(frame, size.to_tuple()))
+    source.release()
+    return frames
+
+
+def benchmark_roi(frames: List[np.ndarray], roi_size: Size, repeats: int) -> Dict[str, float]:
+    height, width = frames[0].shape[:2]
+    poi = [
+        Point(width // 10, height // 5),
+        Point(width - width // 10, height // 4),
+        Point(width - 1, height - 1),
+        Point(0, height - 1),
+    ]
+    roi_maker = RoiMaker(roi_size)
+    durations = []
+    for index in range(repeats):
+        start = time.perf_counter()
+        roi_maker.roi(frames[index % len(frames)], poi)
+        durations.append(time.perf_counter() - start)
+    return {"fps": len(durations) / sum(durations), **latency_summary(durations)}
+
+
+def benchmark_rows(frames: List[np.ndarray], row_count: int, row_size: Size, repeats: int) -> Dict[str, float]:
+    # every row warped and encoded on its own versus one atlas warp and one encode of all rows
+    height, width = frames[0].shape[:2]
+    band = height // row_count
+    rows = [
+        RoiRow(f"row{index}", [
+            Point(width // 10, index * band),
+            Point(width - width // 10, index * band),
+            Point(width - 1, (index + 1) * band - 1),
+            Point(0, (index + 1) * band - 1),
+        ], row_size)
+        for index in range(row_count)
+    ]
+    params = DEFAULT_ENCODING_PROFILES["default"].imencode_params()
+    roi_makers = [RoiMaker(row_size) for _ in rows]
+    atlas = RoiAtlas()
+    atlas.set_rows(rows)
+    atlas_image = np.empty((atlas.size.height, atlas.size.width, 3), dtype=np.uint8)
+
+    separate, packed = [], []
+    for index in range(repeats):
+        frame = frames[index % len(frames)]
+        start = time.perf_counter()
+        for roi_maker, row in zip(roi_makers, rows):
+            cv2.imencode(".jpg", roi_maker.roi(frame, row.polygon), params)
+        separate.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        cv2.imencode(".jpg", atlas.warp(frame, dst=atlas_image), params)
+        packed.append(time.perf_counter() - start)
+    return {
+        "separate_mean_ms": latency_summary(separate)["mean_ms"],
+        "separate_p95_ms": latency_summary(separate)["p95_ms"],
+        "atlas_mean_ms": latency_summary(packed)["mean_ms"],
+        "atlas_p95_ms": latency_summary(packed)["p95_ms"],
+    }
+
+
+def benchmark_compressor(frames: List[np.ndarray], count: int, workers: int) -> Dict[str, float]:
+    encoded = threading.Event()
+    durations = []
+    sizes = []
+    profile = DEFAULT_ENCODING_PROFILES["default"]
+
+    def on_compressed(name: str, data: bytes):
+        sizes.append(len(data))
+        encoded.set()
+
+    pool = CompressorPool({"main"}, frames[0].nbytes, on_compressed, workers=workers)
+    pool.start()
+    try:
+        # round trip of a single frame through shared memory, encoder process and back
+        for index in range(count):
+            encoded.clear()
+            start = time.perf_counter()
+            pool.submit("main", frames[index % len(frames)], profile)
+            encoded.wait()
+            durations.append(time.perf_counter() - start)
+
+        # throughput when frames are submitted faster than they are encoded, stale frames are dropped
+        encoded_before = pool.statistics["main"].encoded
+        start = time.perf_counter()
+        for index in range(count):
+            pool.submit("main", frames[index % len(frames)], profile)
+        submit_duration = time.perf_counter() - start
+        time.sleep(0.5)
+        statistics = pool.statistics["main"]
+        saturated_duration = time.perf_counter() - start
+    finally:
+        pool.stop()
+
+    return {
+        "round_trip_fps": len(durations) / sum(durations),
+        **latency_summary(durations),
+        "mean_bytes": float(np.mean(sizes)),
+        "submit_fps": count / submit_duration,
+        "saturated_encoded_fps": (statistics.encoded - encoded_before) / saturated_duration,
+        "saturated_dropped": statistics.dropped,
+    }
+
+
+async def _mjpeg_client(url: str, latencies: List[float], received: List[int], publish_times: Dict[int, float]):
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as response:
+            boundary = f"--{MJPEG_BOUNDARY}".encode()
+            while True:
+                line = await response.content.readline()
+                if not line:
+                    return
+                if line.strip() != boundary:
+                    continue
+                content_length = 0
+                while True:
+                    header = (await response.content.readline()).strip()
+                    if not header:
+                        break
+                    name, _, value = header.decode().partition(":")
+                    if name.lower() == "content-length":
+                        content_length = int(value)
+                data = await response.content.readexactly(content_length)
+                sequence, = struct.unpack_from("<Q", data)
+                latencies.append(time.perf_counter() - publish_times[sequence])
+                received.append(content_length)
+
+
+async def benchmark_mjpeg(frame_data: bytes, clients: int, rate: float, duration: float) -> Dict[str, float]:
+    server = Server()
+    stream = server.add_mjpeg_stream("/mjpeg/benchmark", stream_rate=rate)
+    runner = web.AppRunner(server.app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+
+    publish_times = dict()
+    latencies = [[] for _ in range(clients)]
+    received = [[] for _ in range(clients)]
+    tasks = [
+        asyncio.create_task(_mjpeg_client(
+            f"http://127.0.0.1:{port}/mjpeg/benchmark?size=full", latencies[index], received[index], publish_times
+        ))
+        for index in range(clients)
+    ]
+    await asyncio.sleep(0.5)
+
+    start = time.perf_counter()
+    sequence = 0
+    while time.perf_counter() - start < duration:
+        # frame is prefixed with its number, so clients can measure delivery latency
+        sequence += 1
+        publish_times[sequence] = time.perf_counter()
+        stream.publish(struct.pack("<Q", sequence) + frame_data)
+        await asyncio.sleep(1 / rate)
+    elapsed = time.perf_counter() - start
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await runner.cleanup()
+
+    all_latencies = [latency for client_latencies in latencies for latency in client_latencies]
+    frames_per_client = [len(client_received) for client_received in received]
+    return {
+        "published_fps": sequence / elapsed,
+        "client_fps_min": min(frames_per_client) / elapsed,
+        "client_fps_mean": float(np.mean(frames_per_client)) / elapsed,
+        "sent_mb_per_s": sum(sum(client_received) for client_received in received) / elapsed / 2 ** 20,
+        **latency_summary(all_latencies),
+    }
+
+
+def benchmark_analyzer(source: FrameSource, duration: float, workers: int, motion_gating=False) -> Dict[str, float]:
+    analyzer = ImageAnalyzer(source, compressor_workers=workers, motion_gating=motion_gating)
+    analyzer.start()
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration and not analyzer.is_source_exhausted:
+        time.sleep(0.1)
+    elapsed = time.perf_counter() - start
+    analyzer.stop()
+
+    result = {
+        f"{name}_fps": count / elapsed
+        for name, count in analyzer.stage_frame_counts.items()
+    }
+    for name, statistics in analyzer.compressor_statistics.items():
+        if statistics.encoded > 0:
+            result[f"{name}_encoded_fps"] = statistics.encoded / elapsed
+            result[f"{name}_encoder_dropped"] = statistics.dropped
+    for name, dropped in analyzer.dropped_frames.items():
+        result[f"{name}_dropped"] = dropped
+    result["motion_skipped"] = analyzer.skipped_frames
+    return result
+
+
+def print_report(title: str, result: Dict[str, float]) -> None:
+    print(title)
+    for name, value in result.items():
+        print(f"  {name:<28}{value:>12.2f}")
+
+
+def create_source(arguments: argparse.Namespace) -> FrameSource:
+    if arguments.video:
+        return VideoFileFrameSource(arguments.video, realtime=arguments.realtime)
+    if arguments.images:
+        return ImageSequenceFrameSource(arguments.images, realtime=arguments.realtime)
+    return ArrayFrameSource([synthetic_image()], realtime=arguments.realtime)
+
+
+def main(arguments: argparse.Namespace) -> None:
+    camera_size = Size(1920 // 2, 1080 // 2)
+    frames = load_frames(create_source(arguments), arguments.frames, camera_size)
+    if not frames:
+        raise RuntimeError("frame source did not provide any frame")
+
+    print_report("RoiMaker.roi", benchmark_roi(frames, Size(512, 256), arguments.frames))
+    for row_count in arguments.rows:
+        print_report(f"{row_count} ROI rows, warp and encode", benchmark_rows(
+            frames, row_count, Size(512, 128), arguments.frames
+        ))
+    print_report("Compressor round trip", benchmark_compressor(frames, arguments.frames, arguments.workers))
+
+    _, frame_data = cv2.imencode(".jpg", frames[0], DEFAULT_ENCODING_PROFILES["default"].imencode_params())
+    mjpeg_result = asyncio.run(
+        benchmark_mjpeg(frame_data.tobytes(), arguments.clients, arguments.rate, arguments.duration)
+    )
+    print_report(f"MJPEG delivery to {arguments.clients} clients", mjpeg_result)
+
+    analyzer_result = benchmark_analyzer(
+        create_source(arguments), arguments.duration, arguments.workers, arguments.motion_gating
+    )
+    print_report("ImageAnalyzer pipeline", analyzer_result)
+    print_report("Peak RSS", peak_rss_mb())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Offline benchmark of the analysis and streaming pipeline")
+    source_group = parser.add_mutually_exclusive_group()
+    source_group.add_argument("--video", help="video file used as frame source")
+    source_group.add_argument("--images", help="glob pattern of an image sequence used as frame source")
+    parser.add_argument("--realtime", action="store_true", help="read frames at their native rate")
+    parser.add_argument("--frames", type=int, default=200, help="frames used by component benchmarks")
+    parser.add_argument("--workers", type=int, default=2, help="encoder processes")
+    parser.add_argument("--clients", type=int, default=20, help="simulated MJPEG clients")
+    parser.add_argument("--rate", type=float, default=10, help="MJPEG stream rate")
+    parser.add_argument("--duration", type=float, default=5, help="seconds of MJPEG and pipeline benchmark")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1, 2, 4, 8], help="ROI row counts to compare")
+    parser.add_argument("--motion-gating", action="store_true", help="skip analysis of frames without change")
+    main(parser.parse_args())
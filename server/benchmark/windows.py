@@ -0,0 +1,89 @@
+import argparse
+import time
+from typing import Callable, Dict, Generator, List
+
+import numpy as np
+
+from server.analysis.lanes import LaneCurve
+from server.analysis.types import Point, Rectangle, Size
+from server.analysis.windows import gather_windows, row_windows, window_starts, curve_windows
+from server.benchmark.encoding import synthetic_image
+
+
+def loop_window_sequence(size: Size, start: int, end: int, steps: int) -> Generator[Rectangle, None, None]:
+    # fixed version of horizontal_window_sequence from _old__main__.py, one rectangle and slice per window
+    for x in window_starts(start, end, steps):
+        yield Rectangle(Point(int(x), 0), size)
+
+
+def loop_features(image: np.ndarray, size: Size, start: int, end: int, steps: int) -> np.ndarray:
+    features = []
+    for window in loop_window_sequence(size, start, end, steps):
+        top_left, bottom_right = window.roi()
+        patch = image[top_left.y:bottom_right.y, top_left.x:bottom_right.x]
+        features.append((patch.mean(), patch.std()))
+    return np.array(features)
+
+
+def batch_features(windows: np.ndarray) -> np.ndarray:
+    axes = tuple(range(1, windows.ndim))
+    return np.stack((windows.mean(axis=axes), windows.std(axis=axes)), axis=1)
+
+
+def measure(function: Callable[[], np.ndarray], repeats: int) -> Dict[str, float]:
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return {"mean_ms": 1000 * float(np.mean(durations)), "p95_ms": 1000 * float(np.percentile(durations, 95))}
+
+
+def main(steps: int, repeats: int) -> None:
+    image = synthetic_image(512, 256)
+    size = Size(16, 16)
+    start, end = 0, image.shape[1] - size.width
+    # end adjusted so windows are spaced by whole pixels and the row version can use the strided view
+    strided_end = (end - start) // max(steps - 1, 1) * (steps - 1) + start
+
+    curve = LaneCurve([Point(20, 60), Point(150, 90), Point(300, 120), Point(490, 110)])
+    t = np.linspace(0, 1, steps)
+    gathered = np.empty((steps, size.height, size.width, 3), dtype=np.uint8)
+
+    def loop_curve() -> np.ndarray:
+        features = []
+        for center in curve.evaluate(t):
+            x, y = np.round(center - (size.width / 2, size.height / 2)).astype(int)
+            patch = image[max(y, 0):y + size.height, max(x, 0):x + size.width]
+            features.append((patch.mean(), patch.std()))
+        return np.array(features)
+
+    cases = {
+        "row loop": lambda: loop_features(image, size, start, strided_end, steps),
+        "row strided view": lambda: batch_features(row_windows(image, size, start, strided_end, steps)),
+        "row gather": lambda: batch_features(gather_windows(
+            image, np.stack((window_starts(start, strided_end, steps), np.zeros(steps, dtype=np.intp)), axis=1),
+            size, out=gathered,
+        )),
+        "curve loop": loop_curve,
+        "curve gather": lambda: batch_features(curve_windows(image, curve, size, t, out=gathered)),
+    }
+
+    print(f"{steps} windows of {size.width}x{size.height} in {image.shape[1]}x{image.shape[0]}, {repeats} repeats")
+    print(f"{'case':<20}{'mean ms':>10}{'p95 ms':>10}")
+    results: List[np.ndarray] = []
+    for name, function in cases.items():
+        results.append(function())
+        result = measure(function, repeats)
+        print(f"{name:<20}{result['mean_ms']:>10.3f}{result['p95_ms']:>10.3f}")
+
+    if not np.allclose(results[0], results[1]) or not np.allclose(results[0], results[2]):
+        raise RuntimeError("row window features differ between loop and batch versions")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sliding window extraction, Python loop versus batch NumPy")
+    parser.add_argument("--steps", type=int, default=128, help="windows along the row or curve")
+    parser.add_argument("--repeats", type=int, default=100)
+    arguments = parser.parse_args()
+    main(arguments.steps, arguments.repeats)
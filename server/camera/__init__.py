@@ -0,0 +1,311 @@
+import json
+import logging
+from dataclasses import dataclass, field
+from multiprocessing import Array, Process, Queue
+from pathlib import Path
+from threading import Thread
+from typing import Callable, Dict, List, Optional, Tuple
+
+from server.analysis.analyzer import ImageAnalyzer, OUTPUT_IMAGES_NAMES, LOW_RESOLUTION_SUFFIX, DEFAULT_ROW_NAME, \
+    default_poi
+from server.analysis.compressor.encoding import EncodingProfile, DEFAULT_ENCODING_PROFILES, \
+    DEFAULT_STREAM_PROFILES, merge_encoding
+from server.analysis.frame_source import FrameSource, RtspFrameSource, VideoFileFrameSource, \
+    ImageSequenceFrameSource
+from server.analysis.lanes import LaneModel
+from server.analysis.occupancy import OccupancyResult
+from server.analysis.roi_maker import RoiRow, atlas_layout
+from server.analysis.types import Point, Rectangle, Size
+from server.camera._run import _run
+from server.camera.frame_board import SharedFrameBoard
+from server.server import MjpegStream
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CameraConfig:
+    name: str
+    source: str
+    source_type: str = "rtsp"
+    fps: float = 10
+    realtime: bool = True
+    camera_size: Size = field(default_factory=lambda: Size(1920 // 2, 1080 // 2))
+    roi_size: Size = field(default_factory=lambda: Size(512, 256))
+    max_atlas_size: Size = field(default_factory=lambda: Size(1024, 1024))  # all ROI rows packed in one image
+    compressor_workers: int = 2
+    backend: str = "gstreamer"
+    decoder_threads: int = 0
+    latency_ms: int = 200
+    rtsp_transport: str = "udp"  # the camera of this project streams over UDP only
+    motion_gating: bool = True
+    max_refresh_interval: float = 30.0
+    history_bytes: int = 32 * 1024 * 1024  # recent encoded frames kept per stream for clip export
+    isolation: str = "process"  # "thread" runs the analysis in the server process, meant for comparison only
+
+    @staticmethod
+    def from_dict(data: Dict) -> "CameraConfig":
+        data = dict(data)
+        for size_name in ("camera_size", "roi_size", "max_atlas_size"):
+            if size_name in data:
+                data[size_name] = Size(**data[size_name])
+        return CameraConfig(**data)
+
+    @property
+    def output_images_names(self) -> List[str]:
+        return sorted(OUTPUT_IMAGES_NAMES)
+
+    @property
+    def max_encoded_size(self) -> int:
+        # encoded image can be bigger than the raw one for noisy images with high quality
+        return 2 * 3 * max(
+            self.camera_size.width * self.camera_size.height,
+            self.roi_size.width * self.roi_size.height,
+            self.max_atlas_size.width * self.max_atlas_size.height,
+        )
+
+    def create_frame_source(self) -> FrameSource:
+        if self.source_type == "rtsp":
+            return RtspFrameSource(
+                self.source,
+                self.fps,
+                output_size=self.camera_size,
+                backend=self.backend,
+                decoder_threads=self.decoder_threads,
+                latency_ms=self.latency_ms,
+                transport=self.rtsp_transport,
+            )
+        if self.source_type == "video":
+            return VideoFileFrameSource(self.source, realtime=self.realtime, loop=True)
+        if self.source_type == "images":
+            return ImageSequenceFrameSource(self.source, self.fps, realtime=self.realtime, loop=True)
+        raise ValueError(f"unknown source type '{self.source_type}' of camera '{self.name}'")
+
+    def create_analyzer(self) -> ImageAnalyzer:
+        return ImageAnalyzer(
+            self.create_frame_source(),
+            compressor_workers=self.compressor_workers,
+            camera_size=self.camera_size,
+            roi_size=self.roi_size,
+            max_atlas_size=self.max_atlas_size,
+            motion_gating=self.motion_gating,
+            max_refresh_interval=self.max_refresh_interval,
+        )
+
+
+def load_camera_configs(camera_config_file_name: str) -> List[CameraConfig]:
+    camera_config_path = Path(__file__).resolve().parent.parent / camera_config_file_name
+    with open(camera_config_path, "r") as camera_config_file:
+        return [CameraConfig.from_dict(camera) for camera in json.load(camera_config_file)]
+
+
+ISOLATION_MODES = ("process", "thread")
+
+
+class CameraWorker:
+    # Server side of one camera. The analysis runs in its own process, so it does not compete for the GIL with the
+    # event loop. This object keeps the camera settings, forwards their changes over the control queue and fans
+    # encoded frames from the shared frame board and results out in the server process.
+    _rows: List[RoiRow]
+    _spots: List[Rectangle]
+    _encoding: Tuple[Dict[str, EncodingProfile], Dict[str, str]]
+    _occupancy_listeners: List[Callable[[OccupancyResult], None]]
+    _frame_listeners: List[Callable[[str, bytes], None]]
+
+    def __init__(self, config: CameraConfig, streams: Dict[str, MjpegStream]):
+        if config.isolation not in ISOLATION_MODES:
+            raise ValueError(f"unknown isolation '{config.isolation}', use one of {list(ISOLATION_MODES)}")
+
+        self.config = config
+        self.streams = streams
+        self._rows = [RoiRow(DEFAULT_ROW_NAME, default_poi(config.camera_size), config.roi_size)]
+        self._spots = []
+        self.lanes = LaneModel()  # lanes are used only by the server, they are not sent to the camera process
+        self._encoding = (dict(DEFAULT_ENCODING_PROFILES), dict(DEFAULT_STREAM_PROFILES))
+        self._last_occupancy = None
+        self._occupancy_listeners = []
+        self._frame_listeners = []
+        self.status = dict()
+
+        self._control_queue = Queue()
+        self._result_queue = Queue()
+        self._watched_names = [name + LOW_RESOLUTION_SUFFIX for name in config.output_images_names]
+        self._watched = Array("i", len(self._watched_names))
+        self._encoded_streams = {name: stream for name, stream in streams.items()}
+        self._encoded_streams.update({
+            name + LOW_RESOLUTION_SUFFIX: stream.low_resolution
+            for name, stream in streams.items()
+        })
+        self._board = SharedFrameBoard(list(self._encoded_streams), config.max_encoded_size)
+        self._board_sequences = {name: 0 for name in self._encoded_streams}
+        self._process = None
+        self._receiver = Thread(target=self._receive, name=f"camera-{config.name}-receiver", daemon=True)
+
+    @property
+    def name(self) -> str:
+        return self.config.name
+
+    @property
+    def output_images_names(self) -> List[str]:
+        return self.config.output_images_names
+
+    @property
+    def rows(self) -> List[RoiRow]:
+        return self._rows
+
+    @rows.setter
+    def rows(self, rows: List[RoiRow]) -> None:
+        # validated here, an error inside the camera process would not reach the caller
+        size, _ = atlas_layout(rows)
+        max_size = self.config.max_atlas_size
+        if size.width > max_size.width or size.height > max_size.height:
+            raise ValueError(f"atlas of {size.width}x{size.height} exceeds {max_size.width}x{max_size.height}")
+        self._rows = list(rows)
+        self._control_queue.put(("rows", self._rows))
+
+    @property
+    def poi(self) -> List[Point]:
+        # single row setup, polygon of the first row
+        return self._rows[0].polygon
+
+    @poi.setter
+    def poi(self, poi: List[Point]) -> None:
+        # only the polygon of the first row changes, other rows and all sizes keep the atlas layout of the spots
+        first, *others = self.rows
+        self.rows = [RoiRow(first.name, list(poi), first.size), *others]
+
+    @property
+    def spots(self) -> List[Rectangle]:
+        return self._spots
+
+    @spots.setter
+    def spots(self, spots: List[Rectangle]) -> None:
+        self._spots = spots
+        self._control_queue.put(("spots", spots))
+
+    @property
+    def encoding_profiles(self) -> Dict[str, EncodingProfile]:
+        return self._encoding[0]
+
+    @property
+    def stream_profiles(self) -> Dict[str, str]:
+        return self._encoding[1]
+
+    def set_encoding(
+            self,
+            profiles: Optional[Dict[str, EncodingProfile]] = None,
+            stream_profiles: Optional[Dict[str, str]] = None,
+    ) -> None:
+        self._encoding = merge_encoding(self._encoding, self.output_images_names, profiles, stream_profiles)
+        self._control_queue.put(("encoding", *self._encoding))
+
+    @property
+    def last_occupancy(self) -> Optional[OccupancyResult]:
+        return self._last_occupancy
+
+    def add_occupancy_listener(self, listener: Callable[[OccupancyResult], None]) -> None:
+        # listeners are called from the receiver thread of the camera
+        self._occupancy_listeners.append(listener)
+
+    def add_frame_listener(self, listener: Callable[[str, bytes], None]) -> None:
+        # called with stream name and encoded frame from the receiver thread, low resolution variants included
+        self._frame_listeners.append(listener)
+
+    def start(self) -> None:
+        state = {
+            "rows": self._rows,
+            "spots": self._spots,
+            "encoding": self._encoding,
+        }
+        args = (
+            self.config,
+            state,
+            self._control_queue,
+            self._result_queue,
+            self._board.attach_args if self.config.isolation == "process" else self._board,
+            self._watched,
+            self._watched_names,
+        )
+        if self.config.isolation == "process":
+            self._process = Process(target=_run, args=args, name=f"camera-{self.name}")
+        else:
+            self._process = Thread(target=_run, args=args, name=f"camera-{self.name}")
+        self._process.start()
+        self._receiver.start()
+        logger.info(f"Camera '{self.name}' started in {self.config.isolation} '{self._process.name}'")
+
+    def stop(self) -> None:
+        if self._process is None:
+            raise AttributeError(f"Camera '{self.name}' did not start yet, cannot stop")
+
+        self._control_queue.put(None)
+        self._receiver.join()
+        self._process.join()
+        self._board.close()
+
+    def _receive(self) -> None:
+        while True:
+            message = self._result_queue.get()
+            if message is None:
+                break
+
+            kind = message[0]
+            if kind == "frame":
+                # queued sequences may be behind, the board always holds the latest frame
+                _, name, _ = message
+                frame = self._board.read(name, self._board_sequences[name])
+                if frame is not None:
+                    self._board_sequences[name], data = frame
+                    self._encoded_streams[name].publish(data)
+                    for listener in self._frame_listeners:
+                        listener(name, data)
+                self._sync_watched()
+            elif kind == "occupancy":
+                occupancy = message[1]
+                self._last_occupancy = occupancy
+                for listener in self._occupancy_listeners:
+                    listener(occupancy)
+            elif kind == "status":
+                self.status = message[1]
+
+    def _sync_watched(self) -> None:
+        # low resolution variants are encoded by the camera process only while they have clients here
+        for index, name in enumerate(self._watched_names):
+            self._watched[index] = int(self._encoded_streams[name].is_watched)
+
+
+class CameraRegistry:
+    _cameras: Dict[str, CameraWorker]
+
+    def __init__(self):
+        self._cameras = dict()
+
+    @property
+    def default(self) -> CameraWorker:
+        if not self._cameras:
+            raise KeyError("no camera is registered")
+        return next(iter(self._cameras.values()))
+
+    def add(self, config: CameraConfig, streams: Dict[str, MjpegStream]) -> CameraWorker:
+        if config.name in self._cameras:
+            raise AttributeError(f"camera '{config.name}' is already registered")
+        camera = CameraWorker(config, streams)
+        self._cameras[config.name] = camera
+        return camera
+
+    def get(self, name: Optional[str]) -> CameraWorker:
+        # no name means the default camera
+        if name is None:
+            return self.default
+        return self._cameras[name]
+
+    def __iter__(self):
+        return iter(self._cameras.values())
+
+    def start(self) -> None:
+        for camera in self._cameras.values():
+            camera.start()
+
+    def stop(self) -> None:
+        for camera in self._cameras.values():
+            camera.stop()
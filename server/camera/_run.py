@@ -0,0 +1,119 @@
+import logging
+import signal
+import threading
+import time
+from multiprocessing import Array
+from queue import Queue, Empty
+from threading import Lock
+from typing import Dict, List, Tuple, Union
+
+from server.analysis.analyzer import ImageAnalyzer, StreamOutput
+from server.camera.frame_board import SharedFrameBoard
+
+logger = logging.getLogger(__name__)
+
+
+class SharedStreamOutput(StreamOutput):
+    # Encoded frames go to the shared frame board, only their sequence numbers are queued to the server. Frames
+    # may be published from more than one thread, a lock per stream keeps a single writer on each board slot as its
+    # seqlock requires.
+    def __init__(self, board: SharedFrameBoard, result_queue: Queue, watched: Array, watched_names: List[str]):
+        self._board = board
+        self._locks = {name: Lock() for name in board.names}
+        self._result_queue = result_queue
+        self._watched = watched
+        self._watched_indices = {name: index for index, name in enumerate(watched_names)}
+
+    def publish(self, name: str, data: bytes) -> None:
+        with self._locks[name]:
+            try:
+                sequence = self._board.publish(name, data)
+            except ValueError as e:
+                logger.error(f"Cannot publish frame: {e}")
+                return
+        self._result_queue.put(("frame", name, sequence))
+
+    def is_watched(self, name: str) -> bool:
+        index = self._watched_indices.get(name)
+        return index is not None and self._watched[index] > 0
+
+
+def _status(analyzer: ImageAnalyzer) -> Dict:
+    return {
+        "stage_throughput": analyzer.stage_throughput,
+        "dropped_frames": analyzer.dropped_frames,
+        "skipped_frames": analyzer.skipped_frames,
+        "capture_failures": analyzer.capture_failures,
+        "stage_frame_counts": analyzer.stage_frame_counts,
+        "latency": analyzer.latency,
+        "compressor_statistics": analyzer.compressor_statistics,
+    }
+
+
+def _apply_command(analyzer: ImageAnalyzer, command: str, arguments: List) -> None:
+    if command == "rows":
+        analyzer.rows = arguments[0]
+    elif command == "spots":
+        analyzer.spots = arguments[0]
+    elif command == "encoding":
+        analyzer.set_encoding(*arguments)
+    else:
+        raise KeyError(f"unknown command '{command}'")
+
+
+def _run(
+        config,
+        state: Dict,
+        control_queue: Queue,
+        result_queue: Queue,
+        board: Union[SharedFrameBoard, Tuple],
+        watched: Array,
+        watched_names: List[str],
+):
+    # the server process handles Ctrl+C and stops cameras through the control queue
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    attached_board = None
+    is_started = False
+    status_interval = 1.0
+    # the end of results is posted even when the setup fails, the server waits for it when stopping the camera
+    try:
+        # a thread shares the board of the server, a process attaches to it
+        if not isinstance(board, SharedFrameBoard):
+            board = attached_board = SharedFrameBoard.attach(*board)
+        analyzer = config.create_analyzer()
+        analyzer.rows = state["rows"]
+        analyzer.spots = state["spots"]
+        analyzer.set_encoding(*state["encoding"])
+        analyzer.output = SharedStreamOutput(board, result_queue, watched, watched_names)
+        analyzer.add_occupancy_listener(lambda occupancy: result_queue.put(("occupancy", occupancy)))
+        analyzer.start()
+        is_started = True
+
+        last_status = time.monotonic()
+        while True:
+            try:
+                message = control_queue.get(timeout=status_interval)
+            except Empty:
+                message = ()
+            if message is None:
+                break
+
+            if message:
+                command, *arguments = message
+                try:
+                    _apply_command(analyzer, command, arguments)
+                except (AttributeError, KeyError, ValueError) as e:
+                    # a bad setting must not stop the camera, the analyzer keeps the previous one
+                    logger.error(f"Camera '{config.name}' cannot apply command '{command}': {e}")
+
+            if time.monotonic() - last_status >= status_interval:
+                result_queue.put(("status", _status(analyzer)))
+                last_status = time.monotonic()
+    finally:
+        if is_started:
+            analyzer.stop()
+        if attached_board is not None:
+            attached_board.close()
+        result_queue.put(None)
@@ -0,0 +1,79 @@
+import time
+from multiprocessing.shared_memory import SharedMemory
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from server.analysis.frame_ring import SharedFrameRing
+
+
+class SharedFrameBoard:
+    # Latest encoded frame of every stream in shared memory, one slot per stream. Each slot is guarded by a sequence
+    # counter which is odd while the frame is being written (seqlock), so the single writer never waits for readers
+    # and readers retry when the frame changed under them. Only the sequence number travels through a queue.
+    _counters: np.ndarray
+
+    def __init__(self, names: List[str], slot_size: int, ring_name: str = None, counters_name: str = None):
+        self._names = list(names)
+        self._indices = {name: index for index, name in enumerate(self._names)}
+        self._ring = SharedFrameRing(len(self._names), slot_size, ring_name)
+        self._is_owner = counters_name is None
+        counters_size = len(self._names) * 2 * np.dtype(np.int64).itemsize
+        if self._is_owner:
+            self._counters_memory = SharedMemory(create=True, size=counters_size)
+        else:
+            self._counters_memory = SharedMemory(name=counters_name)
+        # sequence and size of the frame of every slot
+        self._counters = np.ndarray((len(self._names), 2), dtype=np.int64, buffer=self._counters_memory.buf)
+        if self._is_owner:
+            self._counters.fill(0)
+
+    @property
+    def attach_args(self) -> Tuple[List[str], int, str, str]:
+        return self._names, self._ring.slot_size, self._ring.name, self._counters_memory.name
+
+    @staticmethod
+    def attach(names: List[str], slot_size: int, ring_name: str, counters_name: str) -> "SharedFrameBoard":
+        return SharedFrameBoard(names, slot_size, ring_name, counters_name)
+
+    @property
+    def names(self) -> List[str]:
+        return self._names
+
+    def publish(self, name: str, data: bytes) -> int:
+        # returns sequence number of the published frame, there must be one writer per stream
+        index = self._indices[name]
+        if len(data) > self._ring.slot_size:
+            raise ValueError(f"frame of {len(data)} B of stream '{name}' does not fit into {self._ring.slot_size} B")
+
+        sequence = int(self._counters[index, 0])
+        self._counters[index, 0] = sequence + 1
+        self._counters[index, 1] = self._ring.write_bytes(index, data)
+        self._counters[index, 0] = sequence + 2
+        return (sequence + 2) // 2
+
+    def sequence(self, name: str) -> int:
+        return int(self._counters[self._indices[name], 0]) // 2
+
+    def read(self, name: str, after: int = 0, retries=100) -> Optional[Tuple[int, bytes]]:
+        # latest frame when it is newer than given sequence, None otherwise
+        index = self._indices[name]
+        for _ in range(retries):
+            before = int(self._counters[index, 0])
+            if before % 2 == 1:
+                time.sleep(0)
+                continue
+            if before // 2 <= after:
+                return None
+            data = self._ring.read_bytes(index, int(self._counters[index, 1]))
+            if int(self._counters[index, 0]) == before:
+                return before // 2, data
+        return None
+
+    def close(self) -> None:
+        del self._counters
+        self._counters_memory.close()
+        if self._is_owner:
+            self._counters_memory.unlink()
+        self._ring.close()
+
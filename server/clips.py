@@ -0,0 +1,268 @@
+import struct
+import time
+from collections import deque
+from threading import Lock
+from typing import Deque, Dict, Iterable, Iterator, List, Tuple
+
+from aiohttp import web
+from aiohttp.web_request import Request
+from aiohttp.web_response import Response, StreamResponse
+from aiohttp_apispec import docs, querystring_schema, response_schema
+from marshmallow import Schema, fields, validate, validates_schema, ValidationError
+
+from server.server import RestHandler
+
+DEFAULT_CLIP_DURATION = 10.0
+MAX_CLIP_FPS = 120.0
+CLIP_FORMATS = {
+    "avi": "video/x-msvideo",
+    "mjpeg": "video/x-motion-jpeg",
+}
+
+
+class FrameRing:
+    # Recent encoded frames of one stream kept as they were received, the oldest are evicted when the byte budget
+    # is exceeded, so memory is bounded whatever the frame rate and size. A frame equal to the previous one, as
+    # encoded from a still scene, only extends the previous entry, so still periods cost no memory. Frames are
+    # appended from the camera receiver thread and read by requests in the event loop.
+    _entries: Deque[List]  # first timestamp, last timestamp, repeats, data
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = deque()
+        self._lock = Lock()
+        self._frame_count = 0
+        self.size_bytes = 0
+        self.evicted_frames = 0
+
+    def __len__(self) -> int:
+        return self._frame_count
+
+    def append(self, timestamp: float, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            self.evicted_frames += 1
+            return
+
+        with self._lock:
+            self._frame_count += 1
+            if self._entries and self._entries[-1][3] == data:
+                last = self._entries[-1]
+                last[1] = timestamp
+                last[2] += 1
+                return
+
+            self._entries.append([timestamp, timestamp, 1, data])
+            self.size_bytes += len(data)
+            while self.size_bytes > self.max_bytes:
+                _, _, repeats, evicted = self._entries.popleft()
+                self.size_bytes -= len(evicted)
+                self._frame_count -= repeats
+                self.evicted_frames += repeats
+
+    @property
+    def time_range(self) -> Tuple[float, float]:
+        with self._lock:
+            if not self._entries:
+                return 0.0, 0.0
+            return self._entries[0][0], self._entries[-1][1]
+
+    def frames(self, start: float, end: float) -> List[Tuple[float, bytes]]:
+        # frames are referenced, not copied, evicted frames stay alive while the returned list exists; repeats of
+        # a frame are spread evenly between its first and last timestamp
+        frames = []
+        with self._lock:
+            for first, last, repeats, data in self._entries:
+                if last < start or first > end:
+                    continue
+                step = (last - first) / (repeats - 1) if repeats > 1 else 0.0
+                for index in range(repeats):
+                    timestamp = first + index * step
+                    if start <= timestamp <= end:
+                        frames.append((timestamp, data))
+        return frames
+
+
+class FrameHistory:
+    # rings of the full resolution streams of one camera, low resolution variants are not recorded
+    _rings: Dict[str, FrameRing]
+
+    def __init__(self, names: Iterable[str], max_bytes_per_stream: int):
+        self._rings = {name: FrameRing(max_bytes_per_stream) for name in names}
+
+    @property
+    def rings(self) -> Dict[str, FrameRing]:
+        return self._rings
+
+    def append(self, name: str, data: bytes) -> None:
+        ring = self._rings.get(name)
+        if ring is not None:
+            ring.append(time.time(), data)
+
+
+def jpeg_size(data: bytes) -> Tuple[int, int]:
+    # width and height from the start of frame segment, the image is not decoded
+    if data[:2] != b"\xff\xd8":
+        raise ValueError("not a JPEG image")
+    offset = 2
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            raise ValueError(f"invalid JPEG marker at {offset}")
+        marker = data[offset + 1]
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack_from(">HH", data, offset + 5)
+            return width, height
+        offset += 2 + struct.unpack_from(">H", data, offset + 2)[0]
+    raise ValueError("JPEG has no start of frame segment")
+
+
+def _chunk(fourcc: bytes, payload: bytes) -> bytes:
+    return struct.pack("<4sI", fourcc, len(payload)) + payload
+
+
+def _clip_fps(frames: List[Tuple[float, bytes]]) -> float:
+    # average rate of the clip, frames are played evenly spaced
+    duration = frames[-1][0] - frames[0][0]
+    if len(frames) < 2 or duration <= 0:
+        return 1.0
+    return min((len(frames) - 1) / duration, MAX_CLIP_FPS)
+
+
+def avi_size(frames: List[Tuple[float, bytes]]) -> int:
+    movi_size = 4 + sum(8 + len(data) + len(data) % 2 for _, data in frames)
+    return 12 + 8 + 192 + 8 + movi_size + 8 + 16 * len(frames)
+
+
+def avi_parts(frames: List[Tuple[float, bytes]], width: int, height: int) -> Iterator[bytes]:
+    # Motion JPEG AVI with one video stream, the frames are stored as they are. All sizes are known upfront, so the
+    # file is produced front to back and the JPEG data are yielded without being copied into bigger buffers.
+    fps = _clip_fps(frames)
+    frame_count = len(frames)
+    max_frame_size = max(len(data) for _, data in frames)
+    movi_size = 4 + sum(8 + len(data) + len(data) % 2 for _, data in frames)
+    rate_scale = 1000
+
+    main_header = struct.pack(
+        "<14I",
+        round(1e6 / fps), min(round(max_frame_size * fps), 0xFFFFFFFF), 0, 0x10, frame_count, 0, 1, max_frame_size,
+        width, height, 0, 0, 0, 0,
+    )
+    stream_header = struct.pack(
+        "<4s4sIHHIIIIIIII4h",
+        b"vids", b"MJPG", 0, 0, 0, 0, rate_scale, round(fps * rate_scale), 0, frame_count, max_frame_size,
+        0xFFFFFFFF, 0, 0, 0, width, height,
+    )
+    stream_format = struct.pack("<IiiHH4sIiiII", 40, width, height, 1, 24, b"MJPG", width * height * 3, 0, 0, 0, 0)
+    stream_list = _chunk(b"LIST", b"strl" + _chunk(b"strh", stream_header) + _chunk(b"strf", stream_format))
+    header_list = _chunk(b"LIST", b"hdrl" + _chunk(b"avih", main_header) + stream_list)
+
+    yield struct.pack("<4sI4s", b"RIFF", avi_size(frames) - 8, b"AVI ") + header_list
+    yield struct.pack("<4sI4s", b"LIST", movi_size, b"movi")
+    for _, data in frames:
+        yield struct.pack("<4sI", b"00dc", len(data))
+        yield data
+        if len(data) % 2:
+            yield b"\x00"
+
+    index = bytearray(struct.pack("<4sI", b"idx1", 16 * frame_count))
+    offset = 4  # relative to the movi list type
+    for _, data in frames:
+        index += struct.pack("<4sIII", b"00dc", 0x10, offset, len(data))
+        offset += 8 + len(data) + len(data) % 2
+    yield bytes(index)
+
+
+class ClipQuerySchema(Schema):
+    start = fields.Float(description=f"UNIX timestamp, {DEFAULT_CLIP_DURATION:.0f} s before end if omitted")
+    end = fields.Float(description="UNIX timestamp, now if omitted")
+    format = fields.Str(validate=validate.OneOf(list(CLIP_FORMATS)), description="avi if omitted")
+
+    @validates_schema
+    def validate_range(self, data, **kwargs):
+        if "start" in data and "end" in data and data["end"] <= data["start"]:
+            raise ValidationError("end must be greater than start", "end")
+
+
+class StreamHistorySchema(Schema):
+    name = fields.Str()
+    start = fields.Float()
+    end = fields.Float()
+    frames = fields.Int()
+    size_bytes = fields.Int()
+    max_bytes = fields.Int()
+    evicted_frames = fields.Int()
+
+
+class HistorySchema(Schema):
+    streams = fields.Nested(StreamHistorySchema(many=True))
+
+
+class HistoryHandler(RestHandler):
+    def __init__(self, history: FrameHistory):
+        self.history = history
+
+    @docs(
+        tags=["streams"],
+        summary="Get recorded history",
+        description="Time range and memory use of the recent frames kept for clip export",
+    )
+    @response_schema(HistorySchema())
+    async def get(self, request: Request) -> Response:
+        streams = []
+        for name, ring in self.history.rings.items():
+            start, end = ring.time_range
+            streams.append({
+                "name": name,
+                "start": start,
+                "end": end,
+                "frames": len(ring),
+                "size_bytes": ring.size_bytes,
+                "max_bytes": ring.max_bytes,
+                "evicted_frames": ring.evicted_frames,
+            })
+        return web.json_response(HistorySchema().dump({"streams": streams}))
+
+
+class ClipHandler(RestHandler):
+    def __init__(self, history: FrameHistory):
+        self.history = history
+
+    @docs(
+        tags=["streams"],
+        summary="Export clip",
+        description="Recorded frames of a stream in a time range as Motion JPEG AVI or raw concatenated JPEGs",
+    )
+    @querystring_schema(ClipQuerySchema())
+    async def get(self, request: Request) -> StreamResponse:
+        name = request.match_info["name"]
+        ring = self.history.rings.get(name)
+        if ring is None:
+            raise web.HTTPNotFound(text=f"unknown stream, use one of {sorted(self.history.rings)}")
+
+        query = request["querystring"]
+        end = query.get("end", time.time())
+        start = query.get("start", end - DEFAULT_CLIP_DURATION)
+        clip_format = query.get("format", "avi")
+        frames = ring.frames(start, end)
+        if not frames:
+            raise web.HTTPNotFound(text="no frames recorded in the time range")
+
+        if clip_format == "avi":
+            try:
+                width, height = jpeg_size(frames[0][1])
+            except ValueError as e:
+                raise web.HTTPInternalServerError(text=str(e))
+            parts, size = avi_parts(frames, width, height), avi_size(frames)
+        else:
+            parts, size = (data for _, data in frames), sum(len(data) for _, data in frames)
+
+        response = web.StreamResponse(headers={
+            "Content-Type": CLIP_FORMATS[clip_format],
+            "Content-Disposition": f"attachment; filename=\"{name}-{int(start)}.{clip_format}\"",
+            "X-Frame-Count": str(len(frames)),
+        })
+        response.content_length = size
+        await response.prepare(request)
+        for part in parts:
+            await response.write(part)
+        await response.write_eof()
+        return response
@@ -0,0 +1,85 @@
+from bisect import bisect_left
+from typing import Dict, Iterable, Tuple
+
+# seconds, from a fast remap to a stalled camera read
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+Labels = Dict[str, str]
+
+
+class Histogram:
+    # Cumulative latency histogram for hot paths, an observation is one bisect and two additions. Every histogram
+    # is written by a single thread, readers take a copy.
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def copy(self) -> "Histogram":
+        histogram = Histogram(self.buckets)
+        histogram.counts = list(self.counts)
+        histogram.sum = self.sum
+        return histogram
+
+
+class PrometheusText:
+    # builds a response in the Prometheus text exposition format version 0.0.4
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._lines = []
+
+    def counter(self, name: str, description: str, samples: Iterable[Tuple[Labels, float]]) -> None:
+        self._family(name, description, "counter", samples)
+
+    def gauge(self, name: str, description: str, samples: Iterable[Tuple[Labels, float]]) -> None:
+        self._family(name, description, "gauge", samples)
+
+    def histogram(self, name: str, description: str, samples: Iterable[Tuple[Labels, Histogram]]) -> None:
+        self._header(name, description, "histogram")
+        for labels, histogram in samples:
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                self._sample(f"{name}_bucket", {**labels, "le": repr(float(bound))}, cumulative)
+            cumulative += histogram.counts[-1]
+            self._sample(f"{name}_bucket", {**labels, "le": "+Inf"}, cumulative)
+            self._sample(f"{name}_sum", labels, histogram.sum)
+            self._sample(f"{name}_count", labels, cumulative)
+
+    def render(self) -> str:
+        return "\n".join(self._lines) + "\n"
+
+    def _family(self, name: str, description: str, metric_type: str, samples: Iterable[Tuple[Labels, float]]):
+        self._header(name, description, metric_type)
+        for labels, value in samples:
+            self._sample(name, labels, value)
+
+    def _header(self, name: str, description: str, metric_type: str) -> None:
+        self._lines.append(f"# HELP {name} {description}")
+        self._lines.append(f"# TYPE {name} {metric_type}")
+
+    def _sample(self, name: str, labels: Labels, value: float) -> None:
+        if labels:
+            label_text = ",".join(f"{key}=\"{_escape(str(label))}\"" for key, label in labels.items())
+            name = f"{name}{{{label_text}}}"
+        self._lines.append(f"{name} {_format_value(value)}")
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
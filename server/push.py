@@ -0,0 +1,255 @@
+import asyncio
+import json
+import logging
+import struct
+import time
+from collections import deque
+from threading import Lock
+from typing import Deque, Dict, Optional, Set, Tuple
+
+import numpy as np
+from aiohttp import web, WSMsgType
+from aiohttp.web_request import Request
+from aiohttp_apispec import docs
+from marshmallow import Schema, fields, validate, ValidationError
+
+from server.analysis.occupancy import OccupancyResult
+from server.server import RestHandler, MjpegStream
+
+logger = logging.getLogger(__name__)
+
+# Every message starts with its type byte, all numbers are little endian:
+#   occupancy change and state: type, timestamp f64, spot count u16, then per spot id u16, occupied u8, confidence u8
+#   frame: type, timestamp f64, sequence u32, name length u8, name, size u8 (0 full, 1 low), then JPEG data
+MESSAGE_OCCUPANCY_CHANGE = 1
+MESSAGE_OCCUPANCY_STATE = 2
+MESSAGE_FRAME = 3
+
+OCCUPANCY_HEADER = struct.Struct("<BdH")
+SPOT_RECORD = np.dtype([("id", "<u2"), ("occupied", "u1"), ("confidence", "u1")])
+FRAME_HEADER = struct.Struct("<BdIB")
+FRAME_SIZES = {"full": 0, "low": 1}
+
+
+def occupancy_message(message_type: int, timestamp: float, ids: np.ndarray, occupied: np.ndarray,
+                      confidence: np.ndarray) -> bytes:
+    records = np.empty(len(ids), dtype=SPOT_RECORD)
+    records["id"] = ids
+    records["occupied"] = occupied
+    records["confidence"] = np.round(np.clip(confidence, 0, 1) * 255)
+    return OCCUPANCY_HEADER.pack(message_type, timestamp, len(ids)) + records.tobytes()
+
+
+def frame_message(name: str, size: str, timestamp: float, sequence: int, data: bytes) -> bytes:
+    encoded_name = name.encode()
+    header = FRAME_HEADER.pack(MESSAGE_FRAME, timestamp, sequence & 0xFFFFFFFF, len(encoded_name))
+    return b"".join((header, encoded_name, bytes((FRAME_SIZES[size],)), data))
+
+
+class OccupancyDebouncer:
+    # A spot changes its reported state only after the new state held for hold_time seconds, so a car passing
+    # through or a flickering classification does not produce events. Spots are updated all at once by NumPy.
+    _stable: Optional[np.ndarray]
+
+    def __init__(self, hold_time=2.0):
+        self.hold_time = hold_time
+        self._stable = None
+        self._confidence = np.empty(0, dtype=np.float32)
+        self._changing_since = np.empty(0, dtype=np.float64)
+        self._timestamp = 0.0
+
+    def update(self, result: OccupancyResult) -> np.ndarray:
+        # returns ids of spots whose reported state changed, all spots when their count changed
+        self._timestamp = result.timestamp
+        self._confidence = result.confidence
+        if self._stable is None or len(self._stable) != len(result.occupied):
+            self._stable = result.occupied.copy()
+            self._changing_since = np.full(len(result.occupied), np.nan)
+            return np.arange(len(result.occupied))
+
+        differs = result.occupied != self._stable
+        self._changing_since[~differs] = np.nan
+        self._changing_since[differs & np.isnan(self._changing_since)] = result.timestamp
+        confirmed = np.flatnonzero(differs & (result.timestamp - self._changing_since >= self.hold_time))
+        self._stable[confirmed] = result.occupied[confirmed]
+        self._changing_since[confirmed] = np.nan
+        return confirmed
+
+    def message(self, message_type: int, ids: np.ndarray = None) -> bytes:
+        if self._stable is None:
+            return occupancy_message(message_type, 0.0, np.empty(0), np.empty(0), np.empty(0))
+        if ids is None:
+            ids = np.arange(len(self._stable))
+        return occupancy_message(message_type, self._timestamp, ids, self._stable[ids], self._confidence[ids])
+
+
+class PushClient:
+    # Messages waiting for one connection. Events are queued, frames are latest-wins per stream, so a slow client
+    # skips frames but never misses a state change; it is disconnected when its event queue overflows.
+    _events: Deque[bytes]
+    _frames: Dict[Tuple[str, str], bytes]
+
+    def __init__(self, max_events: int):
+        self._max_events = max_events
+        self._events = deque()
+        self._frames = dict()
+        self._wakeup = asyncio.Event()
+        self.overflowed = False
+
+    def push_event(self, message: bytes) -> None:
+        if len(self._events) >= self._max_events:
+            self.overflowed = True
+        else:
+            self._events.append(message)
+        self._wakeup.set()
+
+    def push_frame(self, key: Tuple[str, str], message: bytes) -> None:
+        self._frames[key] = message
+        self._wakeup.set()
+
+    async def next_messages(self):
+        await self._wakeup.wait()
+        self._wakeup.clear()
+        messages = list(self._events)
+        self._events.clear()
+        messages.extend(self._frames.values())
+        self._frames.clear()
+        return messages
+
+
+class PushChannel:
+    # Push of one camera. A message is serialized once per event or frame and the same bytes are queued to all
+    # clients. Occupancy is published from the camera receiver thread and handed over to the event loop.
+    _clients: Set[PushClient]
+    _frame_messages: Dict[Tuple[str, str], Tuple[int, bytes]]
+
+    def __init__(self, streams: Dict[str, MjpegStream], hold_time=2.0, max_events=256):
+        self.streams = streams
+        self._max_events = max_events
+        self._lock = Lock()
+        self._debouncer = OccupancyDebouncer(hold_time)
+        self._loop = None
+        self._clients = set()
+        self._frame_messages = dict()
+
+    def bind(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+
+    def publish_occupancy(self, result: OccupancyResult) -> None:
+        with self._lock:
+            changed = self._debouncer.update(result)
+            if len(changed) == 0 or self._loop is None:
+                return
+            message = self._debouncer.message(MESSAGE_OCCUPANCY_CHANGE, changed)
+        self._loop.call_soon_threadsafe(self._broadcast, message)
+
+    def connect(self) -> PushClient:
+        client = PushClient(self._max_events)
+        with self._lock:
+            client.push_event(self._debouncer.message(MESSAGE_OCCUPANCY_STATE))
+        self._clients.add(client)
+        return client
+
+    def disconnect(self, client: PushClient) -> None:
+        self._clients.discard(client)
+
+    def frame_message(self, name: str, size: str, sequence: int, stream: MjpegStream) -> bytes:
+        # cached for the last sequence, so all clients subscribed to a stream send the same bytes
+        key = (name, size)
+        cached = self._frame_messages.get(key)
+        if cached is None or cached[0] != sequence:
+            cached = sequence, frame_message(name, size, time.time(), sequence, stream.raw_image_data)
+            self._frame_messages[key] = cached
+        return cached[1]
+
+    def _broadcast(self, message: bytes) -> None:
+        for client in self._clients:
+            client.push_event(message)
+
+
+class FrameSubscriptionSchema(Schema):
+    size = fields.Str(load_default="full", validate=validate.OneOf(list(FRAME_SIZES)))
+    fps = fields.Float(allow_nan=False, validate=validate.Range(min=0, min_inclusive=False))
+
+
+class SubscriptionSchema(Schema):
+    frames = fields.Dict(keys=fields.Str(), values=fields.Nested(FrameSubscriptionSchema), required=True)
+
+
+class PushHandler(RestHandler):
+    # Clients subscribe to frames by a text message {"frames": {"<stream>": {"size": "full|low", "fps": 2}}},
+    # an empty object stops all frames. Occupancy state is sent on connect and its changes afterwards.
+    def __init__(self, channel: PushChannel, max_fps=10.0):
+        self.channel = channel
+        self.max_fps = max_fps
+
+    @docs(
+        tags=["streams"],
+        summary="Push channel",
+        description="WebSocket of binary occupancy change messages and optionally requested JPEG frames",
+    )
+    async def get(self, request: Request) -> web.WebSocketResponse:
+        websocket = web.WebSocketResponse(heartbeat=30)
+        await websocket.prepare(request)
+        self.channel.bind(asyncio.get_running_loop())
+        client = self.channel.connect()
+        sender = asyncio.create_task(self._send(websocket, client))
+        subscriptions = dict()
+        logger.info(f"Push client connected from {request.remote}")
+        try:
+            async for message in websocket:
+                if message.type != WSMsgType.TEXT:
+                    continue
+                try:
+                    self._subscribe(client, subscriptions, SubscriptionSchema().load(json.loads(message.data)))
+                except ValidationError as e:
+                    await websocket.send_str(json.dumps({"error": e.messages}))
+                except (ValueError, KeyError) as e:
+                    await websocket.send_str(json.dumps({"error": str(e)}))
+        finally:
+            for task in subscriptions.values():
+                task.cancel()
+            sender.cancel()
+            self.channel.disconnect(client)
+            logger.info(f"Push client from {request.remote} disconnected")
+        return websocket
+
+    def _subscribe(self, client: PushClient, subscriptions: Dict[str, asyncio.Task], request: Dict) -> None:
+        # request is validated by SubscriptionSchema, all of it is checked before current subscriptions are replaced
+        frames = dict()
+        for name, options in request["frames"].items():
+            if name not in self.channel.streams:
+                raise KeyError(f"unknown stream '{name}'")
+            frames[name] = options["size"], min(max(options.get("fps", self.max_fps), 0.1), self.max_fps)
+
+        for task in subscriptions.values():
+            task.cancel()
+        subscriptions.clear()
+        for name, (size, rate) in frames.items():
+            subscriptions[name] = asyncio.create_task(self._push_frames(client, name, size, rate))
+
+    async def _push_frames(self, client: PushClient, name: str, size: str, rate: float) -> None:
+        stream = self.channel.streams[name]
+        if size == "low":
+            stream = stream.low_resolution
+        stream.watcher_count += 1
+        try:
+            sequence = max(stream.sequence - 1, 0)
+            while True:
+                sequence, _ = await stream.wait_frame(sequence)
+                client.push_frame((name, size), self.channel.frame_message(name, size, sequence, stream))
+                await asyncio.sleep(1 / rate)
+        finally:
+            stream.watcher_count -= 1
+
+    @staticmethod
+    async def _send(websocket: web.WebSocketResponse, client: PushClient) -> None:
+        try:
+            while not websocket.closed:
+                for message in await client.next_messages():
+                    await websocket.send_bytes(message)
+                if client.overflowed:
+                    logger.warning("Push client does not keep up with events, closing connection")
+                    await websocket.close()
+        except ConnectionResetError:
+            pass
@@ -1,14 +1,16 @@
 import asyncio
 import logging
-from dataclasses import dataclass
+import time
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Optional, Tuple
 
-from aiohttp import web, MultipartWriter
+from aiohttp import web
 from aiohttp.web_request import Request
 from aiohttp.web_response import Response
 from aiohttp_apispec import setup_aiohttp_apispec, validation_middleware
 
+from server.assets import AssetCache
+
 logger = logging.getLogger(__name__)
 
 
@@ -29,9 +31,99 @@ class RestHandler:
         pass
 
 
-@dataclass
+MJPEG_BOUNDARY = "frame-start"
+
+
 class MjpegStream:
-    raw_image_data: bytearray
+    # Broadcasts the latest encoded frame to all connected clients. Frames can be published from any thread, the
+    # multipart part is built once per frame and clients are woken up only when a new frame arrives.
+    _loop: Optional[asyncio.AbstractEventLoop]
+    _new_frame: Optional[asyncio.Event]
+
+    def __init__(self, low_resolution: "MjpegStream" = None):
+        self._loop = None
+        self._new_frame = None
+        self._sequence = 0
+        self._raw_image_data = bytes()
+        self._part = bytes()
+        self.low_resolution = low_resolution
+        self.client_count = 0  # MJPEG connections
+        self.watcher_count = 0  # snapshot long-polls and push subscriptions, they only keep the stream encoded
+        self.frames_sent = 0
+        self.bytes_sent = 0
+
+    @property
+    def sequence(self) -> int:
+        return self._sequence
+
+    @property
+    def is_watched(self) -> bool:
+        return self.client_count + self.watcher_count > 0
+
+    @property
+    def raw_image_data(self) -> bytes:
+        return self._raw_image_data
+
+    @raw_image_data.setter
+    def raw_image_data(self, data: bytes) -> None:
+        self.publish(data)
+
+    def bind(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+        self._new_frame = asyncio.Event()
+        if self.low_resolution is not None:
+            self.low_resolution.bind(loop)
+
+    def publish(self, data: bytes) -> None:
+        if self._loop is None:
+            self._set_frame(data)
+        else:
+            self._loop.call_soon_threadsafe(self._set_frame, data)
+
+    async def wait_frame(self, sequence: int) -> Tuple[int, bytes]:
+        # returns the first frame newer than given sequence as a ready to send multipart part
+        while self._sequence <= sequence:
+            await self._new_frame.wait()
+        return self._sequence, self._part
+
+    def _set_frame(self, data: bytes) -> None:
+        header = f"--{MJPEG_BOUNDARY}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(data)}\r\n\r\n"
+        self._part = b"".join((header.encode(), data, b"\r\n"))
+        self._raw_image_data = data
+        self._sequence += 1
+        if self._new_frame is not None:
+            new_frame, self._new_frame = self._new_frame, asyncio.Event()
+            new_frame.set()
+
+
+class MjpegClientRate:
+    # Per connection rate, halved when the client does not keep up and slowly restored when it does
+    def __init__(self, max_rate: float, min_rate: float):
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.rate = max_rate
+        self.sent_at_max_rate = 0
+
+    @property
+    def period(self) -> float:
+        return 1 / self.rate
+
+    @property
+    def is_at_minimum(self) -> bool:
+        return self.rate <= self.min_rate
+
+    def congested(self) -> None:
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.sent_at_max_rate = 0
+
+    def sent(self) -> None:
+        self.rate = min(self.max_rate, self.rate * 1.1)
+        if self.rate >= self.max_rate:
+            self.sent_at_max_rate += 1
+
+    def reset(self) -> None:
+        self.rate = self.max_rate
+        self.sent_at_max_rate = 0
 
 
 class Server:
@@ -39,8 +131,11 @@ class Server:
 
     def __init__(self):
         self.app = web.Application()
+        self.app.on_startup.append(self._bind_streams)
+        self.app.on_startup.append(self._load_assets)
         self._mjpeg_streams = dict()
         self._static_folder = Path(__file__).resolve().parent.parent / "frontend" / "dist" / "spa"
+        self._assets = AssetCache(self._static_folder)
 
     def add_handler(self, path: str, handler: RestHandler):
         allowed_http_methods = ["get", "post", "put", "patch", "delete"]
@@ -58,7 +153,8 @@ class Server:
         default_func = getattr(RestHandler, http_method)
         return handler_func != default_func
 
-    def run(self):
+    def setup(self):
+        # request validation and static files, benchmarks call it and run the app on their own
         setup_aiohttp_apispec(
             app=self.app,
             title="Parking statistics",
@@ -69,51 +165,104 @@ class Server:
         )
         self.app.middlewares.append(validation_middleware)
         self.app.middlewares.append(self._static_serve)
-        self.app.add_routes([web.static('/', self._static_folder)])
+
+    def run(self):
+        self.setup()
         web.run_app(self.app)
 
+    async def _bind_streams(self, app: web.Application):
+        loop = asyncio.get_running_loop()
+        for stream in self._mjpeg_streams.values():
+            stream.bind(loop)
+
+    async def _load_assets(self, app: web.Application):
+        await asyncio.get_running_loop().run_in_executor(None, self._assets.load)
+
     @web.middleware
     async def _static_serve(self, request, handler):
         request_path = Path(request.path).relative_to("/")
         if len(request_path.parts) > 0 and request_path.parts[0] in {"mjpeg", "api"}:
             return await handler(request)
 
-        file_path = self._static_folder / request_path  # rebase into static dir
-        if not file_path.exists():
+        asset = self._assets.get(request_path.as_posix() if request_path.parts else "")
+        if asset is None:
             return web.HTTPNotFound()
-        if file_path.is_dir():
-            file_path /= 'index.html'
-            if not file_path.exists():
-                return web.HTTPNotFound()
-        return web.FileResponse(file_path)
+        return self._assets.response(request, asset)
 
-    def add_mjpeg_stream(self, path: str, stream_rate=10) -> MjpegStream:
+    def add_mjpeg_stream(self, path: str, stream_rate=10, min_stream_rate=1, stream: MjpegStream = None) -> MjpegStream:
+        # clients can ask for ?fps=<rate>&size=<auto|full|low>, with auto size a client which does not keep up even
+        # at min_stream_rate is switched to the low resolution variant and back when it recovers
         if path in self._mjpeg_streams:
             raise AttributeError(f"path '{path}' is already in use")
 
-        stream = MjpegStream(bytearray())
+        if stream is None:
+            stream = MjpegStream(low_resolution=MjpegStream())
         self._mjpeg_streams[path] = stream
+        sizes = {"auto", "full", "low"}
+        recover_after = 10 * stream_rate  # frames sent at full rate before leaving the low resolution variant
 
         async def handle_mjpeg(request: Request):
+            try:
+                requested_rate = float(request.query.get("fps", stream_rate))
+            except ValueError:
+                raise web.HTTPBadRequest(text="fps must be a number")
+            size = request.query.get("size", "auto")
+            if size not in sizes:
+                raise web.HTTPBadRequest(text=f"size must be one of {sorted(sizes)}")
+
             logger.info(f"Client connected to MJPEG stream '{path}'")
-            boundary = 'frame-start'
+            rate = MjpegClientRate(min(max(requested_rate, min_stream_rate), stream_rate), min_stream_rate)
+            source = stream.low_resolution if size == "low" else stream
+            source.client_count += 1
             response = web.StreamResponse(
                 status=200,
                 reason='OK',
                 headers={
-                    "Content-Type": f"multipart/x-mixed-replace;boundary={boundary}"
+                    "Content-Type": f"multipart/x-mixed-replace;boundary={MJPEG_BOUNDARY}"
                 }
             )
             try:
                 await response.prepare(request)
+                sequence = max(source.sequence - 1, 0)  # send the latest frame right away
                 while True:
-                    with MultipartWriter('image/jpeg', boundary=boundary) as writer:
-                        writer.append(stream.raw_image_data, {'Content-Type': 'image/jpeg'})
-                        await writer.write(response, close_boundary=False)
+                    sequence, part = await source.wait_frame(sequence)
+                    sent_at = time.monotonic()
+
+                    transport = request.transport
+                    if transport is None:
+                        raise ConnectionResetError("Connection lost")
 
-                    await asyncio.sleep(1 / stream_rate)
+                    if transport.get_write_buffer_size() > 0:
+                        # previous frame is still not in the socket, drop this one instead of queueing it
+                        rate.congested()
+                        if size == "auto" and source is stream and rate.is_at_minimum:
+                            logger.info(f"Client of MJPEG stream '{path}' switched to low resolution")
+                            source, sequence = _switch_source(source, stream.low_resolution), 0
+                            rate.reset()
+                    else:
+                        await response.write(part)
+                        source.frames_sent += 1
+                        source.bytes_sent += len(part)
+                        rate.sent()
+                        if size == "auto" and source is not stream and rate.sent_at_max_rate >= recover_after:
+                            logger.info(f"Client of MJPEG stream '{path}' switched to full resolution")
+                            source, sequence = _switch_source(source, stream), 0
+                            rate.reset()
+
+                    # client rate is an upper limit, frames published in the meantime are skipped
+                    remaining = rate.period - (time.monotonic() - sent_at)
+                    if remaining > 0:
+                        await asyncio.sleep(remaining)
             except Exception as e:
                 logger.info(f"Client disconnected from MJPEG stream '{path}' because '{e}'")
+            finally:
+                source.client_count -= 1
 
         self.app.router.add_get(path, handle_mjpeg)
         return stream
+
+
+def _switch_source(current: MjpegStream, new: MjpegStream) -> MjpegStream:
+    current.client_count -= 1
+    new.client_count += 1
+    return new
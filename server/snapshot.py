@@ -0,0 +1,77 @@
+import asyncio
+import uuid
+from typing import Dict
+
+from aiohttp import web
+from aiohttp.web_request import Request
+from aiohttp.web_response import Response
+from aiohttp_apispec import docs, querystring_schema
+from marshmallow import Schema, fields, validate
+
+from server.server import RestHandler, MjpegStream
+
+MAX_POLL_TIMEOUT = 30.0
+# one id per server run shared by all snapshot routes, so a frame has the same ETag on every route serving it
+RUN_ID = uuid.uuid4().hex[:8]
+
+
+class SnapshotQuerySchema(Schema):
+    after = fields.Int(validate=validate.Range(min=0), description="wait for the first frame after this sequence")
+    timeout = fields.Float(
+        validate=validate.Range(min=0, max=MAX_POLL_TIMEOUT),
+        description="seconds to wait for the frame, 204 is returned when none arrives",
+    )
+    size = fields.Str(validate=validate.OneOf(["full", "low"]))
+
+
+class SnapshotHandler(RestHandler):
+    # Latest encoded frame of a stream as a single JPEG. ETag is built from the frame sequence and an id of this
+    # server run, so tags from before a restart never match.
+    def __init__(self, streams: Dict[str, MjpegStream]):
+        self.streams = streams
+
+    @docs(
+        tags=["streams"],
+        summary="Get stream snapshot",
+        description="Latest JPEG of a stream, X-Frame-Sequence header holds its sequence for long-polling by 'after'",
+    )
+    @querystring_schema(SnapshotQuerySchema())
+    async def get(self, request: Request) -> Response:
+        stream = self.streams.get(request.match_info["name"])
+        if stream is None:
+            raise web.HTTPNotFound(text=f"unknown stream, use one of {sorted(self.streams)}")
+
+        query = request["querystring"]
+        if query.get("size") == "low":
+            stream = stream.low_resolution
+
+        if "after" in query:
+            sequence = await self._wait_frame(stream, query["after"], query.get("timeout", MAX_POLL_TIMEOUT))
+            if sequence is None:
+                return web.Response(status=204, headers={"X-Frame-Sequence": str(stream.sequence)})
+        elif stream.sequence == 0:
+            raise web.HTTPServiceUnavailable(text="stream has no frame yet")
+
+        # sequence and data are read together, the stream is updated only from this event loop
+        sequence, data = stream.sequence, stream.raw_image_data
+        etag = f"\"{RUN_ID}-{sequence}\""
+        headers = {
+            "ETag": etag,
+            "Cache-Control": "no-cache",
+            "X-Frame-Sequence": str(sequence),
+        }
+        if etag in (tag.strip().removeprefix("W/") for tag in request.headers.get("If-None-Match", "").split(",")):
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=data, content_type="image/jpeg", headers=headers)
+
+    @staticmethod
+    async def _wait_frame(stream: MjpegStream, after: int, timeout: float):
+        # a waiting request keeps the low resolution variant encoded, it is not counted as an MJPEG client
+        stream.watcher_count += 1
+        try:
+            sequence, _ = await asyncio.wait_for(stream.wait_frame(after), timeout)
+            return sequence
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            stream.watcher_count -= 1
@@ -0,0 +1,335 @@
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from threading import Lock
+from typing import Callable, Dict, Hashable, List, Tuple
+
+import numpy as np
+
+from server.analysis.occupancy import OccupancyResult
+from server.statistics.store import OccupancyStore, day_start
+
+logger = logging.getLogger(__name__)
+
+FREE_STREAKS_FILE_NAME = "free_streaks.npy"
+
+
+@dataclass
+class FreeStreaks:
+    # per spot summary of free minutes of a continuous time span, spans are combined without rereading minutes
+    start: float
+    end: float
+    longest: np.ndarray
+    longest_start: np.ndarray
+    prefix: np.ndarray
+    suffix: np.ndarray
+
+    @property
+    def minutes(self) -> int:
+        return int(round((self.end - self.start) / 60))
+
+    @staticmethod
+    def from_minutes(start: float, minutes: np.ndarray) -> "FreeStreaks":
+        # minutes are (samples, occupied samples) of shape (minutes, spots, 2), a minute is free when most of its
+        # samples are free, minutes without samples break a streak
+        samples = minutes[:, :, 0].astype(np.int64)
+        free = (samples > 0) & (2 * minutes[:, :, 1].astype(np.int64) < samples)
+        count, spot_count = free.shape
+        if count == 0:
+            zeros = np.zeros(spot_count, dtype=np.int64)
+            return FreeStreaks(start, start, zeros, np.full(spot_count, start), zeros, zeros)
+
+        indices = np.arange(count)[:, np.newaxis]
+        last_busy = np.maximum.accumulate(np.where(free, -1, indices), axis=0)
+        run_length = indices - last_busy
+        longest = run_length.max(axis=0)
+        longest_end = run_length.argmax(axis=0)
+        busy = ~free
+        prefix = np.where(busy.any(axis=0), busy.argmax(axis=0), count)
+        return FreeStreaks(
+            start,
+            start + 60 * count,
+            longest,
+            start + 60.0 * (longest_end - longest + 1),
+            prefix,
+            run_length[-1],
+        )
+
+    def to_array(self) -> np.ndarray:
+        spot_count = len(self.longest)
+        return np.concatenate((
+            [self.start, self.end, spot_count],
+            self.longest, self.longest_start, self.prefix, self.suffix,
+        )).astype(np.float64)
+
+    @staticmethod
+    def from_array(array: np.ndarray) -> "FreeStreaks":
+        start, end, spot_count = array[:3]
+        columns = array[3:].reshape((4, int(spot_count)))
+        return FreeStreaks(
+            start,
+            end,
+            columns[0].astype(np.int64),
+            columns[1],
+            columns[2].astype(np.int64),
+            columns[3].astype(np.int64),
+        )
+
+
+class OccupancyStatistics:
+    # Aggregates for the statistics API. Weekday/hour counts and daily totals are kept in memory and updated on every
+    # append, closed days are summarized once. Query results are cached together with the version of the data they
+    # depend on, so appends invalidate only answers which cover the changed data.
+    _cache: "OrderedDict[Hashable, Tuple[int, object]]"
+    _closed_days: List[date]
+    _free_streaks: Dict[date, FreeStreaks]
+
+    def __init__(self, store: OccupancyStore, cache_size=1024):
+        self._store = store
+        self._spots = store.max_spots
+        self._cache_size = cache_size
+        self._lock = Lock()
+        self._cache = OrderedDict()
+
+        self._weekday_hour = np.zeros((7, 24, self._spots, 2), dtype=np.uint64)
+        self._cell_versions = np.zeros((7, 24), dtype=np.int64)
+        self._cell_start = 0.0
+        self._cell_end = 0.0
+        self._cell = (0, 0)
+
+        self._closed_days = []
+        self._closed_day_indices = dict()
+        self._closed_daily = np.zeros((0, self._spots, 2), dtype=np.uint64)
+        self._free_streaks = dict()
+        self._current_day = None
+        self._current_day_start = float("inf")
+        self._current_daily = np.zeros((self._spots, 2), dtype=np.uint64)
+        self._version = 0
+        self._spot_count = 0
+
+        self._load()
+
+    @property
+    def spot_count(self) -> int:
+        return self._spot_count
+
+    def _load(self) -> None:
+        load_start = time.monotonic()
+        today = date.today()
+        closed_daily = []
+        for day in self._store.days():
+            daily = self._store.day_rollup(day, "day")
+            hourly = self._store.day_rollup(day, "hour")
+            if daily is None or hourly is None:
+                continue
+
+            self._add_hours(day, hourly)
+            used_spots = np.flatnonzero(daily[0, :, 0])
+            if used_spots.size > 0:
+                self._spot_count = max(self._spot_count, int(used_spots[-1]) + 1)
+            if day == today:
+                self._current_day = day
+                self._current_day_start = day_start(day)
+                self._current_daily = daily[0].astype(np.uint64)
+            else:
+                self._closed_day_indices[day] = len(self._closed_days)
+                self._closed_days.append(day)
+                closed_daily.append(daily[0].astype(np.uint64))
+
+        if closed_daily:
+            self._closed_daily = np.stack(closed_daily)
+        logger.info(f"Loaded statistics of {len(closed_daily)} days in {time.monotonic() - load_start:.2f} s")
+
+    def _add_hours(self, day: date, hourly: np.ndarray) -> None:
+        start = day_start(day)
+        for hour_index in range(_minutes_in_day(day) // 60):
+            local_time = time.localtime(start + 3600 * hour_index)
+            self._weekday_hour[local_time.tm_wday, local_time.tm_hour] += hourly[hour_index]
+
+    def append(self, result: OccupancyResult) -> None:
+        spot_count = min(len(result.occupied), self._spots)
+        if spot_count == 0:
+            return
+
+        occupied = result.occupied[:spot_count]
+        with self._lock:
+            day = datetime.fromtimestamp(result.timestamp).date()
+            if day != self._current_day:
+                self._close_current_day()
+                self._current_day = day
+                self._current_day_start = day_start(day)
+
+            self._current_daily[:spot_count, 0] += 1
+            self._current_daily[:spot_count, 1] += occupied
+
+            weekday, hour = self._weekday_hour_cell(result.timestamp)
+            cell = self._weekday_hour[weekday, hour, :spot_count]
+            cell[:, 0] += 1
+            cell[:, 1] += occupied
+            self._cell_versions[weekday, hour] += 1
+
+            self._version += 1
+            self._spot_count = max(self._spot_count, spot_count)
+
+    def _weekday_hour_cell(self, timestamp: float) -> Tuple[int, int]:
+        # local time is resolved once per hour
+        if not self._cell_start <= timestamp < self._cell_end:
+            local_time = time.localtime(timestamp)
+            self._cell = (local_time.tm_wday, local_time.tm_hour)
+            self._cell_start = timestamp - local_time.tm_min * 60 - local_time.tm_sec - timestamp % 1
+            self._cell_end = self._cell_start + 3600
+        return self._cell
+
+    def _close_current_day(self) -> None:
+        if self._current_day is None:
+            return
+        self._closed_day_indices[self._current_day] = len(self._closed_days)
+        self._closed_days.append(self._current_day)
+        self._closed_daily = np.concatenate((self._closed_daily, self._current_daily[np.newaxis]))
+        self._current_daily = np.zeros((self._spots, 2), dtype=np.uint64)
+
+    def free_probability(self, weekday: int, hour: int) -> Tuple[np.ndarray, np.ndarray]:
+        # probability that a spot is free on given weekday (0 is Monday) and local hour, and number of samples
+        def compute():
+            counts = self._weekday_hour[weekday, hour, :self._spot_count].astype(np.float64)
+            samples = counts[:, 0]
+            probability = np.divide(samples - counts[:, 1], samples, out=np.zeros_like(samples), where=samples > 0)
+            return probability, samples.astype(np.int64)
+
+        with self._lock:
+            return self._cached(("free_probability", weekday, hour), int(self._cell_versions[weekday, hour]), compute)
+
+    def average_occupancy(self, start: float, end: float) -> Tuple[np.ndarray, np.ndarray]:
+        # average occupancy of every spot in given time range, whole days come from daily totals and only the
+        # partially covered days are read in minute resolution
+        def compute():
+            counts = np.zeros((self._spot_count, 2), dtype=np.float64)
+            for day, day_range_start, day_range_end, is_whole in self._days_between(start, end):
+                if is_whole:
+                    counts += self._daily(day)[:self._spot_count]
+                    continue
+                minutes = self._store.day_rollup(day, "minute", self._spot_count)
+                if minutes is not None:
+                    first, last = self._minute_range(day, day_range_start, day_range_end)
+                    counts += minutes[first:last].sum(axis=0)
+
+            samples = counts[:, 0]
+            average = np.divide(counts[:, 1], samples, out=np.zeros_like(samples), where=samples > 0)
+            return average, samples.astype(np.int64)
+
+        with self._lock:
+            return self._cached(("average_occupancy", start, end), self._range_version(end), compute)
+
+    def longest_free_streak(self, start: float, end: float) -> Tuple[np.ndarray, np.ndarray]:
+        # longest continuously free time of every spot in given range as minutes and start timestamp
+        def compute():
+            streaks = []
+            for day, day_range_start, day_range_end, is_whole in self._days_between(start, end):
+                if is_whole and day != self._current_day:
+                    streaks.append(self._closed_day_free_streaks(day))
+                    continue
+                minutes = self._store.day_rollup(day, "minute", self._spot_count)
+                if minutes is not None:
+                    first, last = self._minute_range(day, day_range_start, day_range_end)
+                    streaks.append(FreeStreaks.from_minutes(day_start(day) + 60 * first, minutes[first:last]))
+            return _longest_streak(streaks, self._spot_count)
+
+        with self._lock:
+            return self._cached(("longest_free_streak", start, end), self._range_version(end), compute)
+
+    def _cached(self, key: Hashable, version: int, compute: Callable[[], object]):
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] == version:
+            self._cache.move_to_end(key)
+            return cached[1]
+
+        value = compute()
+        self._cache[key] = (version, value)
+        self._cache.move_to_end(key)
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return value
+
+    def _range_version(self, end: float) -> int:
+        # data before the current day never change, their answers stay valid
+        return 0 if end <= self._current_day_start else self._version
+
+    def _daily(self, day: date) -> np.ndarray:
+        if day == self._current_day:
+            return self._current_daily
+        return self._closed_daily[self._closed_day_indices[day]]
+
+    def _days_between(self, start: float, end: float) -> List[Tuple[date, float, float, bool]]:
+        known_days = set(self._closed_days)
+        if self._current_day is not None:
+            known_days.add(self._current_day)
+
+        days = []
+        for day in sorted(known_days):
+            range_start = max(start, day_start(day))
+            range_end = min(end, day_start(day + timedelta(days=1)))
+            if range_start < range_end:
+                is_whole = range_start == day_start(day) and range_end == day_start(day + timedelta(days=1))
+                days.append((day, range_start, range_end, is_whole))
+        return days
+
+    @staticmethod
+    def _minute_range(day: date, range_start: float, range_end: float) -> Tuple[int, int]:
+        start = day_start(day)
+        return int((range_start - start) // 60), int(np.ceil((range_end - start) / 60))
+
+    def _closed_day_free_streaks(self, day: date) -> FreeStreaks:
+        # closed days never change, their summary is computed once and kept next to the day segment
+        streaks = self._free_streaks.get(day)
+        if streaks is not None and len(streaks.longest) >= self._spot_count:
+            return streaks
+
+        path = self._store.segment_path(day) / FREE_STREAKS_FILE_NAME
+        if path.exists():
+            streaks = FreeStreaks.from_array(np.load(path))
+        if streaks is None or len(streaks.longest) < self._spot_count:
+            minutes = self._store.day_rollup(day, "minute", self._spot_count)
+            streaks = FreeStreaks.from_minutes(day_start(day), minutes[:_minutes_in_day(day)])
+            np.save(path, streaks.to_array())
+        self._free_streaks[day] = streaks
+        return streaks
+
+
+def _minutes_in_day(day: date) -> int:
+    return int(round((day_start(day + timedelta(days=1)) - day_start(day)) / 60))
+
+
+def _longest_streak(streaks: List[FreeStreaks], spot_count: int) -> Tuple[np.ndarray, np.ndarray]:
+    # combines consecutive span summaries, a free run continues across spans only if they touch
+    best = np.zeros(spot_count, dtype=np.int64)
+    best_start = np.zeros(spot_count, dtype=np.float64)
+    run = np.zeros(spot_count, dtype=np.int64)
+    run_start = np.zeros(spot_count, dtype=np.float64)
+    previous_end = None
+
+    for streaks in streaks:
+        longest = streaks.longest[:spot_count]
+        prefix = streaks.prefix[:spot_count]
+        if previous_end != streaks.start:
+            run[:] = 0
+
+        is_continued = run > 0
+        run_start = np.where(is_continued, run_start, streaks.start)
+        crossing = run + prefix
+
+        is_better = crossing > best
+        best = np.where(is_better, crossing, best)
+        best_start = np.where(is_better, run_start, best_start)
+
+        is_better = longest > best
+        best = np.where(is_better, longest, best)
+        best_start = np.where(is_better, streaks.longest_start[:spot_count], best_start)
+
+        is_whole_free = prefix == streaks.minutes
+        run = np.where(is_whole_free, crossing, streaks.suffix[:spot_count])
+        run_start = np.where(is_whole_free, run_start, streaks.end - 60.0 * run)
+        previous_end = streaks.end
+
+    return best, best_start
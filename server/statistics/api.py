@@ -0,0 +1,137 @@
+import math
+import time
+
+from aiohttp import web
+from aiohttp.web_request import Request
+from aiohttp.web_response import Response
+from aiohttp_apispec import docs, querystring_schema, response_schema
+from marshmallow import Schema, fields, validate, validates_schema, ValidationError
+
+from server.server import RestHandler
+from server.statistics.aggregates import OccupancyStatistics
+
+
+# open ended ranges end at the next whole minute, the resolution of the rollups, so repeated polls share a cache
+# entry instead of each adding a new one
+OPEN_END_RESOLUTION = 60
+
+
+def _open_end() -> float:
+    return math.ceil(time.time() / OPEN_END_RESOLUTION) * OPEN_END_RESOLUTION
+
+
+class WeekdayHourQuerySchema(Schema):
+    weekday = fields.Int(required=True, validate=validate.Range(min=0, max=6), description="0 is Monday")
+    hour = fields.Int(required=True, validate=validate.Range(min=0, max=23), description="local hour")
+
+
+class TimeRangeQuerySchema(Schema):
+    start = fields.Float(required=True, description="UNIX timestamp")
+    end = fields.Float(description="UNIX timestamp, now if omitted")
+
+    @validates_schema
+    def validate_range(self, data, **kwargs):
+        if "end" in data and data["end"] <= data["start"]:
+            raise ValidationError("end must be greater than start", "end")
+
+
+class SpotFreeProbabilitySchema(Schema):
+    id = fields.Int()
+    probability = fields.Float()
+    samples = fields.Int()
+
+
+class FreeProbabilitySchema(Schema):
+    weekday = fields.Int()
+    hour = fields.Int()
+    spots = fields.Nested(SpotFreeProbabilitySchema(many=True))
+
+
+class SpotAverageOccupancySchema(Schema):
+    id = fields.Int()
+    average = fields.Float()
+    samples = fields.Int()
+
+
+class AverageOccupancySchema(Schema):
+    start = fields.Float()
+    end = fields.Float()
+    spots = fields.Nested(SpotAverageOccupancySchema(many=True))
+
+
+class SpotFreeStreakSchema(Schema):
+    id = fields.Int()
+    minutes = fields.Int()
+    start = fields.Float(allow_none=True)
+
+
+class FreeStreakSchema(Schema):
+    start = fields.Float()
+    end = fields.Float()
+    spots = fields.Nested(SpotFreeStreakSchema(many=True))
+
+
+class FreeProbabilityHandler(RestHandler):
+    def __init__(self, statistics: OccupancyStatistics):
+        self.statistics = statistics
+
+    @docs(
+        tags=["statistics"],
+        summary="Get probability of free spots",
+        description="Probability that each spot is free on given weekday and hour",
+    )
+    @querystring_schema(WeekdayHourQuerySchema())
+    @response_schema(FreeProbabilitySchema())
+    async def get(self, request: Request) -> Response:
+        weekday = request["querystring"]["weekday"]
+        hour = request["querystring"]["hour"]
+        probability, samples = self.statistics.free_probability(weekday, hour)
+        spots = [
+            {"id": spot_id, "probability": spot_probability, "samples": spot_samples}
+            for spot_id, (spot_probability, spot_samples) in enumerate(zip(probability.tolist(), samples.tolist()))
+        ]
+        return web.json_response(FreeProbabilitySchema().dump({"weekday": weekday, "hour": hour, "spots": spots}))
+
+
+class AverageOccupancyHandler(RestHandler):
+    def __init__(self, statistics: OccupancyStatistics):
+        self.statistics = statistics
+
+    @docs(
+        tags=["statistics"],
+        summary="Get average occupancy",
+        description="Average occupancy of each spot in given time range",
+    )
+    @querystring_schema(TimeRangeQuerySchema())
+    @response_schema(AverageOccupancySchema())
+    async def get(self, request: Request) -> Response:
+        start = request["querystring"]["start"]
+        end = request["querystring"]["end"] if "end" in request["querystring"] else _open_end()
+        average, samples = self.statistics.average_occupancy(start, end)
+        spots = [
+            {"id": spot_id, "average": spot_average, "samples": spot_samples}
+            for spot_id, (spot_average, spot_samples) in enumerate(zip(average.tolist(), samples.tolist()))
+        ]
+        return web.json_response(AverageOccupancySchema().dump({"start": start, "end": end, "spots": spots}))
+
+
+class FreeStreakHandler(RestHandler):
+    def __init__(self, statistics: OccupancyStatistics):
+        self.statistics = statistics
+
+    @docs(
+        tags=["statistics"],
+        summary="Get longest free streak",
+        description="Longest continuously free time of each spot in given time range in minutes",
+    )
+    @querystring_schema(TimeRangeQuerySchema())
+    @response_schema(FreeStreakSchema())
+    async def get(self, request: Request) -> Response:
+        start = request["querystring"]["start"]
+        end = request["querystring"]["end"] if "end" in request["querystring"] else _open_end()
+        minutes, streak_starts = self.statistics.longest_free_streak(start, end)
+        spots = [
+            {"id": spot_id, "minutes": spot_minutes, "start": streak_start if spot_minutes > 0 else None}
+            for spot_id, (spot_minutes, streak_start) in enumerate(zip(minutes.tolist(), streak_starts.tolist()))
+        ]
+        return web.json_response(FreeStreakSchema().dump({"start": start, "end": end, "spots": spots}))
@@ -0,0 +1,259 @@
+import logging
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from server.analysis.occupancy import OccupancyResult
+
+logger = logging.getLogger(__name__)
+
+# one file per column in every day segment, records are fixed width and stored in append order
+COLUMNS = {
+    "timestamp": np.dtype("<f8"),
+    "spot": np.dtype("<u2"),
+    "state": np.dtype("u1"),
+    "confidence": np.dtype("<f4"),
+}
+
+# rollup bins hold (samples, occupied samples) per spot, 25 hours cover days with daylight saving change
+ROLLUP_DTYPE = np.dtype("<u4")
+ROLLUP_RESOLUTIONS = {
+    "minute": 60,
+    "hour": 3600,
+    "day": 25 * 3600,
+}
+SECONDS_PER_SEGMENT = 25 * 3600
+
+
+def day_start(day: date) -> float:
+    return time.mktime(day.timetuple())
+
+
+class DaySegment:
+    _rollups: Dict[str, np.memmap]
+
+    def __init__(self, root: Path, day: date, max_spots: int, writable: bool):
+        self.day = day
+        self.start = day_start(day)
+        self.end = day_start(day + timedelta(days=1))
+        self.path = root / day.isoformat()
+        self._max_spots = max_spots
+        self._writable = writable
+        if writable:
+            self.path.mkdir(parents=True, exist_ok=True)
+
+        self._rollups = {
+            resolution: self._open_rollup(resolution, SECONDS_PER_SEGMENT // seconds)
+            for resolution, seconds in ROLLUP_RESOLUTIONS.items()
+        }
+
+    def _open_rollup(self, resolution: str, bins: int) -> Optional[np.memmap]:
+        path = self.path / f"{resolution}.rollup"
+        shape = (bins, self._max_spots, 2)
+        if path.exists():
+            return np.memmap(path, dtype=ROLLUP_DTYPE, mode="r+" if self._writable else "r", shape=shape)
+        if self._writable:
+            return np.memmap(path, dtype=ROLLUP_DTYPE, mode="w+", shape=shape)
+        return None
+
+    def add(self, timestamp: float, occupied: np.ndarray) -> None:
+        # all spots of one frame fall into the same bins, so rollups are updated by whole-row additions
+        offset = timestamp - self.start
+        spot_count = len(occupied)
+        for resolution, seconds in ROLLUP_RESOLUTIONS.items():
+            row = self._rollups[resolution][int(offset // seconds), :spot_count]
+            row[:, 0] += 1
+            row[:, 1] += occupied
+
+    def rollup(self, resolution: str) -> Optional[np.memmap]:
+        return self._rollups[resolution]
+
+    def column(self, name: str) -> np.ndarray:
+        path = self.path / f"{name}.column"
+        if not path.exists() or path.stat().st_size == 0:
+            return np.empty(0, dtype=COLUMNS[name])
+        return np.memmap(path, dtype=COLUMNS[name], mode="r")
+
+    def append_columns(self, columns: Dict[str, np.ndarray]) -> None:
+        for name, values in columns.items():
+            with open(self.path / f"{name}.column", "ab") as column_file:
+                column_file.write(values.tobytes())
+
+    def flush(self) -> None:
+        for rollup in self._rollups.values():
+            if rollup is not None:
+                rollup.flush()
+
+
+class OccupancyStore:
+    # Append-only column store of per-frame occupancy with one segment directory per local day. Raw records are
+    # buffered in fixed arrays and appended to column files, rollups are memory mapped and updated on every append,
+    # so range queries read rollup bins or binary search the timestamp column instead of scanning raw records.
+    _segments: "OrderedDict[date, DaySegment]"
+    _buffer: Dict[str, np.ndarray]
+
+    def __init__(self, root: Path, max_spots=256, buffer_records=8192, flush_interval=5.0, open_segments=64):
+        self._root = root
+        self._root.mkdir(parents=True, exist_ok=True)
+        self._max_spots = max_spots
+        self._flush_interval = flush_interval
+        self._open_segments = open_segments
+        self._lock = Lock()
+        self._segments = OrderedDict()
+        self._current_segment = None
+        self._buffer = {name: np.empty(buffer_records, dtype=dtype) for name, dtype in COLUMNS.items()}
+        self._buffered = 0
+        self._last_flush = time.monotonic()
+
+    @property
+    def max_spots(self) -> int:
+        return self._max_spots
+
+    def append(self, result: OccupancyResult) -> None:
+        spot_count = len(result.occupied)
+        if spot_count == 0:
+            return
+        if spot_count > self._max_spots:
+            logger.warning(f"Only first {self._max_spots} of {spot_count} spots are stored")
+            spot_count = self._max_spots
+
+        occupied = result.occupied[:spot_count].astype(np.uint8)
+        with self._lock:
+            segment = self._writable_segment(result.timestamp)
+            if self._buffered + spot_count > len(self._buffer["timestamp"]):
+                self._flush_buffer()
+
+            records = slice(self._buffered, self._buffered + spot_count)
+            self._buffer["timestamp"][records] = result.timestamp
+            self._buffer["spot"][records] = np.arange(spot_count)
+            self._buffer["state"][records] = occupied
+            self._buffer["confidence"][records] = result.confidence[:spot_count]
+            self._buffered += spot_count
+
+            segment.add(result.timestamp, occupied)
+
+            if time.monotonic() - self._last_flush > self._flush_interval:
+                self._flush_buffer()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_buffer()
+
+    def close(self) -> None:
+        self.flush()
+
+    def days(self) -> List[date]:
+        days = []
+        for path in self._root.iterdir():
+            if not path.is_dir():
+                continue
+            try:
+                days.append(date.fromisoformat(path.name))
+            except ValueError:
+                logger.warning(f"Skipping directory '{path}', its name is not a day")
+        return sorted(days)
+
+    def segment_path(self, day: date) -> Path:
+        return self._root / day.isoformat()
+
+    def day_rollup(self, day: date, resolution: str, spot_count: int = None) -> Optional[np.ndarray]:
+        if resolution not in ROLLUP_RESOLUTIONS:
+            raise ValueError(f"unknown resolution '{resolution}', use one of {list(ROLLUP_RESOLUTIONS)}")
+
+        with self._lock:
+            if not self.segment_path(day).is_dir():
+                return None
+            rollup = self._segment(day).rollup(resolution)
+            if rollup is None:
+                return None
+            return np.array(rollup[:, :spot_count])
+
+    def records(self, start: float, end: float) -> Dict[str, np.ndarray]:
+        # raw records with start <= timestamp < end, only the timestamp column of overlapping days is searched
+        parts = {name: [] for name in COLUMNS}
+        with self._lock:
+            self._flush_buffer()
+            for segment in self._segments_between(start, end):
+                timestamps = segment.column("timestamp")
+                first, last = np.searchsorted(timestamps, (start, end))
+                for name in COLUMNS:
+                    parts[name].append(np.array(segment.column(name)[first:last]))
+        return {
+            name: np.concatenate(values) if values else np.empty(0, dtype=COLUMNS[name])
+            for name, values in parts.items()
+        }
+
+    def rollup(self, resolution: str, start: float, end: float) -> Tuple[np.ndarray, np.ndarray]:
+        # returns bin start timestamps and (samples, occupied) counts of shape (bins, max_spots, 2)
+        if resolution not in ROLLUP_RESOLUTIONS:
+            raise ValueError(f"unknown resolution '{resolution}', use one of {list(ROLLUP_RESOLUTIONS)}")
+
+        seconds = ROLLUP_RESOLUTIONS[resolution]
+        starts = []
+        counts = []
+        with self._lock:
+            for segment in self._segments_between(start, end):
+                rollup = segment.rollup(resolution)
+                if rollup is None:
+                    continue
+                if resolution == "day":
+                    bin_starts = np.array([segment.start])
+                    first, last = 0, 1
+                else:
+                    bin_starts = segment.start + seconds * np.arange(np.ceil((segment.end - segment.start) / seconds))
+                    first = np.searchsorted(bin_starts + seconds, start, side="right")
+                    last = np.searchsorted(bin_starts, end)
+                starts.append(bin_starts[first:last])
+                counts.append(np.array(rollup[first:last]))
+
+        if not starts:
+            return np.empty(0), np.empty((0, self._max_spots, 2), dtype=ROLLUP_DTYPE)
+        return np.concatenate(starts), np.concatenate(counts)
+
+    def _segments_between(self, start: float, end: float) -> List[DaySegment]:
+        first_day = datetime.fromtimestamp(max(start, 0)).date()
+        last_day = datetime.fromtimestamp(min(end, 2 ** 33)).date()
+        return [
+            self._segment(day)
+            for day in self.days()
+            if first_day <= day <= last_day
+        ]
+
+    def _segment(self, day: date) -> DaySegment:
+        segment = self._segments.get(day)
+        if segment is None:
+            segment = DaySegment(self._root, day, self._max_spots, writable=False)
+            self._segments[day] = segment
+            if len(self._segments) > self._open_segments:
+                oldest_day = next(iter(self._segments))
+                if self._current_segment is None or oldest_day != self._current_segment.day:
+                    del self._segments[oldest_day]
+        self._segments.move_to_end(day)
+        return segment
+
+    def _writable_segment(self, timestamp: float) -> DaySegment:
+        day = datetime.fromtimestamp(timestamp).date()
+        if self._current_segment is None or self._current_segment.day != day:
+            self._flush_buffer()
+            if self._current_segment is not None:
+                # closed days are reopened read only by queries
+                self._segments.pop(self._current_segment.day, None)
+                self._current_segment.flush()
+            self._current_segment = DaySegment(self._root, day, self._max_spots, writable=True)
+            self._segments[day] = self._current_segment
+        return self._current_segment
+
+    def _flush_buffer(self) -> None:
+        if self._buffered > 0 and self._current_segment is not None:
+            self._current_segment.append_columns({
+                name: values[:self._buffered]
+                for name, values in self._buffer.items()
+            })
+            self._current_segment.flush()
+        self._buffered = 0
+        self._last_flush = time.monotonic()